@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+AccessState = namedtuple(
+    "AccessState", ["lots", "titles", "places", "vip", "members", "user_lots", "users"]
+)
+
+
+class AccessControl:
+    def __init__(self, lots=(), users=(), places=None):
+        self._state = None
+        self.update(lots, users, places or {})
+
+    def update(self, lots, users, places):
+        titles = dict(lots)
+        lot_ids = tuple(titles)
+        order = {lot: i for i, lot in enumerate(lot_ids)}
+        users = sorted(
+            (user for user in users if user[0] in order),
+            key=lambda user: order[user[0]],
+        )
+
+        user_lots = {}
+        for lot, user_id, _ in users:
+            user_lots.setdefault(user_id, []).append(lot)
+
+        state = AccessState(
+            lot_ids,
+            titles,
+            {lot: tuple(places.get(lot, ())) for lot in lot_ids},
+            frozenset((lot, user_id) for lot, user_id, role in users if role == "vip"),
+            frozenset((lot, user_id) for lot, user_id, _ in users),
+            {user_id: tuple(lots) for user_id, lots in user_lots.items()},
+            frozenset(user_lots),
+        )
+        changed = (
+            self._state is None
+            or self._state.lots != state.lots
+            or self._state.titles != state.titles
+            or self._state.places != state.places
+        )
+        # Обработчики читают состояние целиком через одну ссылку, поэтому
+        # замена атомарна и не требует блокировок.
+        self._state = state
+        return changed
+
+    @property
+    def lots(self):
+        return self._state.lots
+
+    @property
+    def users(self):
+        return self._state.users
+
+    @property
+    def members(self):
+        return self._state.members
+
+    @property
+    def places_by_lot(self):
+        return self._state.places
+
+    @property
+    def titles(self):
+        return self._state.titles
+
+    def title(self, lot):
+        return self._state.titles.get(lot, lot)
+
+    def places(self, lot):
+        return self._state.places.get(lot, ())
+
+    def lots_for(self, user_id):
+        return self._state.user_lots.get(user_id, ())
+
+    def is_vip(self, lot, user_id):
+        return (lot, user_id) in self._state.vip
+
+    def is_authorized(self, lot, user_id):
+        return (lot, user_id) in self._state.members
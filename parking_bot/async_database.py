@@ -0,0 +1,145 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from config import DB_POOL_SIZE
+
+# Чтение из sqlite3 выполняется в отдельных потоках, чтобы не блокировать
+# цикл событий бота.
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="database")
+
+
+async def run_in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_write(operation, *args, **kwargs):
+    # Записи выполняет единственный поток DatabaseWriter, поэтому результат
+    # ожидается через его Future без занятия потока из пула.
+    return await asyncio.wrap_future(operation.submit(*args, **kwargs))
+
+
+def shutdown_executor():
+    _executor.shutdown(wait=True)
+    database.close_connections()
+
+
+async def get_schedule_snapshot(lot, start):
+    version, schedule = database.get_cached_schedule(lot, start)
+    if schedule is not None:
+        return version, schedule
+    return await run_in_executor(database.get_schedule_snapshot, lot, start)
+
+
+async def get_free_counts(lot, places, dates):
+    _, availability = database.get_cached_availability(lot, places)
+    if availability is not None:
+        return [availability.free_count(date) for date in dates]
+    return await run_in_executor(database.get_free_counts, lot, places, dates)
+
+
+async def pick_free_place(lot, places, date, preferred=()):
+    _, availability = database.get_cached_availability(lot, places)
+    if availability is not None:
+        return availability.pick(date, availability.mask(preferred))
+    return await run_in_executor(database.pick_free_place, lot, places, date, preferred)
+
+
+async def get_booked_places_for_button(lot, username):
+    return await run_in_executor(database.get_booked_places_for_button, lot, username)
+
+
+async def restore_bookings():
+    return await run_write(database.restore_bookings)
+
+
+async def get_subscriptions(lot, user_id):
+    return await run_in_executor(database.get_subscriptions, lot, user_id)
+
+
+async def set_subscription_mode(lot, user_id, kind):
+    return await run_write(database.set_subscription_mode, lot, user_id, kind)
+
+
+async def toggle_subscription(lot, user_id, kind, value=""):
+    return await run_write(database.toggle_subscription, lot, user_id, kind, value)
+
+
+async def get_notification_recipients(lot, place, weekday, released=False):
+    return await run_in_executor(
+        database.get_notification_recipients, lot, place, weekday, released
+    )
+
+
+async def set_notification_mode(user_id, mode):
+    return await run_write(database.set_notification_mode, user_id, mode)
+
+
+async def add_digest_events(user_ids, message):
+    return await run_write(database.add_digest_events, user_ids, message)
+
+
+async def pop_digest_events(modes):
+    return await run_write(database.pop_digest_events, modes)
+
+
+async def book_permanent(lot, place, username, date, is_vip):
+    return await run_write(database.book_permanent, lot, place, username, date, is_vip)
+
+
+async def book_temporary(lot, place, username, date, is_vip):
+    return await run_write(database.book_temporary, lot, place, username, date, is_vip)
+
+
+async def remove_place_booking(lot, place, username, date, is_vip):
+    return await run_write(
+        database.remove_place_booking, lot, place, username, date, is_vip
+    )
+
+
+async def join_waitlist(lot, date, place, username, user_id):
+    return await run_write(database.join_waitlist, lot, date, place, username, user_id)
+
+
+async def leave_waitlist(lot, date, place, user_id):
+    return await run_write(database.leave_waitlist, lot, date, place, user_id)
+
+
+async def load_pending_deletions():
+    return await run_in_executor(database.load_pending_deletions)
+
+
+async def record_job_run(name):
+    return await run_write(database.record_job_run, name)
+
+
+async def load_access():
+    return await run_in_executor(database.load_access)
+
+
+async def get_user_lot(user_id):
+    return await run_in_executor(database.get_user_lot, user_id)
+
+
+async def set_user_lot(user_id, lot):
+    return await run_write(database.set_user_lot, user_id, lot)
+
+
+async def set_user_role(lot, user_id, role):
+    return await run_write(database.set_user_role, lot, user_id, role)
+
+
+async def remove_user(lot, user_id):
+    return await run_write(database.remove_user, lot, user_id)
+
+
+async def add_place(lot, name):
+    return await run_write(database.add_place, lot, name)
+
+
+async def remove_place(lot, name):
+    return await run_write(database.remove_place, lot, name)
@@ -0,0 +1,47 @@
+class Availability:
+    def __init__(self, places, occupied):
+        # Бит места — его позиция в меню парковки, поэтому занятость даты
+        # хранится одним целым числом, а свободные места ищутся битовыми
+        # операциями без перебора мест.
+        self.places = tuple(places)
+        self._bits = {place: 1 << i for i, place in enumerate(self.places)}
+        self._all = (1 << len(self.places)) - 1
+        self._occupied = {}
+        for date, place in occupied:
+            bit = self._bits.get(place)
+            if bit is not None:
+                self._occupied[date] = self._occupied.get(date, 0) | bit
+
+    def update(self, changes):
+        # changes: тройки (date, place, occupied) с текущей занятостью мест,
+        # которые изменила запись броней.
+        for date, place, occupied in changes:
+            bit = self._bits.get(place)
+            if bit is None:
+                continue
+            mask = self._occupied.get(date, 0)
+            mask = mask | bit if occupied else mask & ~bit
+            if mask:
+                self._occupied[date] = mask
+            else:
+                self._occupied.pop(date, None)
+
+    def mask(self, places):
+        mask = 0
+        for place in places:
+            mask |= self._bits.get(place, 0)
+        return mask
+
+    def free_mask(self, date):
+        return self._all & ~self._occupied.get(date.isoformat(), 0)
+
+    def free_count(self, date):
+        return bin(self.free_mask(date)).count("1")
+
+    def pick(self, date, preferred=0):
+        free = self.free_mask(date)
+        candidates = free & preferred or free
+        if not candidates:
+            return None
+        # Младший установленный бит — первое подходящее место в меню.
+        return self.places[(candidates & -candidates).bit_length() - 1]
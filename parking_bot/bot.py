@@ -1,8 +1,8 @@
 import asyncio
 import datetime
+import html
 import time
-import telegram
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,44 +13,164 @@ from telegram.ext import (
 )
 from telegram.error import TimedOut, NetworkError
 
-from config import API_TOKEN, VIP_USERS, WHITELIST_USERS
+from config import (
+    API_TOKEN,
+    ADMIN_USERS,
+    LOTS,
+    BROADCAST_WORKERS,
+    BROADCAST_RATE,
+    BROADCAST_CHAT_INTERVAL,
+    BROADCAST_MAX_RETRIES,
+    NOTIFY_COALESCE_SECONDS,
+    DIGEST_TIME,
+    ROLLOVER_TIME,
+    SWEEP_INTERVAL,
+    ACCESS_RELOAD_INTERVAL,
+)
+from broadcast import Broadcaster, merge_messages
+from sweeper import MessageSweeper
+import callbacks
+from callbacks import CallbackRouter
+from access import AccessControl
+from migrations import migrate
 from database import (
-    init_db,
-    create_booking,
-    remove_booking,
-    get_schedule,
-    get_booked_places,
-    restore_bookings,
-    create_temp_booking,
-    create_temp_bookings_table,
-    get_temp_booked_places,
-    delete_booking,
-    delete_temp_booking,
-    check_is_permtemp_status,
+    ensure_default_subscriptions,
+    roll_calendar,
+    seed_access_tables,
+    load_access as load_access_sync,
+    get_job_runs,
+)
+from async_database import (
+    get_schedule_snapshot,
+    get_free_counts,
+    pick_free_place,
     get_booked_places_for_button,
-    get_permanent_booking_for_day,
-    get_user_temp_booking_for_day,
-    restore_bookings_manually,
-    get_temp_booked_info,
-    delete_temp_bookings_from_temp_handler,
+    book_permanent,
+    book_temporary,
+    remove_place_booking,
+    join_waitlist,
+    leave_waitlist,
+    get_subscriptions,
+    set_subscription_mode,
+    toggle_subscription,
+    set_notification_mode,
+    get_notification_recipients,
+    add_digest_events,
+    pop_digest_events,
+    restore_bookings,
+    load_pending_deletions,
+    record_job_run,
+    load_access,
+    get_user_lot,
+    set_user_lot,
+    set_user_role,
+    remove_user,
+    add_place,
+    remove_place,
+    shutdown_executor,
 )
-from places import PLACES
+from views import NOTIFICATION_MODES, RUSSIAN_DAYS, Views
+
+access = AccessControl()
+router = CallbackRouter(access.places_by_lot)
+views = Views(router, access.places_by_lot, access.titles)
+
+
+def apply_access(lots, users, places):
+    if access.update(lots, users, places):
+        views.set_lots(access.places_by_lot, access.titles)
+
+
+async def reload_access(context: ContextTypes.DEFAULT_TYPE):
+    # Периодическая перезагрузка подхватывает изменения, сделанные
+    # администратором через другой процесс бота.
+    apply_access(*await load_access())
+
+
+def is_authorized(lot, user_id):
+    return access.is_authorized(lot, user_id)
+
+
+def is_admin(user_id):
+    return user_id in ADMIN_USERS
+
+
+def available_lots(user_id):
+    # Администраторы управляют всеми парковками, даже если сами в них не
+    # бронируют места.
+    return access.lots if is_admin(user_id) else access.lots_for(user_id)
+
+
+def next_date(weekday, week=None):
+    # Кнопка дня недели относится к ближайшей такой дате, начиная с сегодня,
+    # или к дате через week недель после нее.
+    today = datetime.date.today()
+    return today + datetime.timedelta(
+        days=(weekday - today.weekday()) % 7, weeks=week or 0
+    )
+
+
+def week_range(week):
+    start = datetime.date.today() + datetime.timedelta(weeks=week)
+    end = start + datetime.timedelta(days=6)
+    return f"{start.strftime('%d.%m')} – {end.strftime('%d.%m')}"
+
+
+async def notify_users(context, lot, message, place, weekday, released=False):
+    recipients = await get_notification_recipients(lot, place, weekday, released)
+    all_users = [
+        user_id for user_id in recipients if access.is_authorized(lot, user_id)
+    ]
+    if len(access.lots) > 1:
+        message = f"{access.title(lot)}: {message}"
+    instant_users = [
+        user_id for user_id in all_users if recipients[user_id] == "instant"
+    ]
+    digest_users = [
+        user_id for user_id in all_users if recipients[user_id] != "instant"
+    ]
+
+    context.bot_data["broadcaster"].notify(instant_users, message)
+    if digest_users:
+        await add_digest_events(digest_users, message)
+
+
+async def send_digests(context: ContextTypes.DEFAULT_TYPE):
+    # Ежедневная сводка собирает и события пользователей, которые уже
+    # переключились на мгновенные уведомления, чтобы ничего не потерялось.
+    modes = ["daily", "instant"]
+    if datetime.date.today().weekday() == 0:
+        modes.append("weekly")
+
+    digests = await pop_digest_events(modes)
+    broadcaster = context.bot_data["broadcaster"]
 
+    for user_id, events in digests.items():
+        if user_id not in access.users:
+            continue
+        messages = [f"{created_at[:16]} {message}" for created_at, message in events]
+        for text in merge_messages("Сводка изменений бронирований:", messages):
+            broadcaster.enqueue([user_id], text)
 
-def is_authorized(user_id):
-    return user_id in VIP_USERS or user_id in WHITELIST_USERS
+    await record_job_run("send_digests")
 
 
-async def notify_users(context, message):
-    all_users = VIP_USERS + WHITELIST_USERS
-    for user_id in all_users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-        except Exception:
-            pass
+def is_job_missed(last_run, run_time):
+    now = datetime.datetime.now().astimezone()
+    due = datetime.datetime.combine(now.date(), run_time)
+    if now < due:
+        due -= datetime.timedelta(days=1)
+    return last_run is None or last_run < due
 
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def expire_bookings(context: ContextTypes.DEFAULT_TYPE):
+    # Временные брони истекают при смене дня, поэтому задача запускается сразу
+    # после полуночи и не требует перезапуска бота.
+    await restore_bookings()
+    await record_job_run("expire_bookings")
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
     user_id = (
         update.message.from_user.id
         if update.message
@@ -68,7 +188,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if not is_authorized(user_id):
+    lots = available_lots(user_id)
+    if not lots:
         (
             await update.message.reply_text(
                 "У вас нет доступа для использования этого бота."
@@ -80,57 +201,55 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    permanent_bookings_count = get_booked_places_for_button(username)
+    context.bot_data["broadcaster"].unblock(user_id)
 
-    keyboard = [[InlineKeyboardButton("Расписание", callback_data="schedule")]]
+    if payload is not None and payload.lot in lots:
+        lot = payload.lot
+        if payload.action == callbacks.SELECT_LOT:
+            await set_user_lot(user_id, lot)
+    else:
+        lot = await get_user_lot(user_id)
+        if lot not in lots:
+            lot = lots[0] if len(lots) == 1 else None
 
-    if permanent_bookings_count < 3:
-        keyboard.append(
-            [InlineKeyboardButton("Забронировать перманентно", callback_data="book")]
+    if lot is None:
+        text = "Выберите парковку:"
+        reply_markup = views.lot_keyboard(lots)
+    else:
+        text = "Выберите действие:"
+        if len(lots) > 1:
+            text = f"Парковка: {access.title(lot)}\n{text}"
+        permanent_bookings_count = await get_booked_places_for_button(lot, username)
+        reply_markup = views.main_menu(
+            lot, permanent_bookings_count, can_switch=len(lots) > 1
         )
 
-    keyboard.append(
-        [InlineKeyboardButton("Забронировать временно", callback_data="temp_book")]
-    )
-    keyboard.append([InlineKeyboardButton("Удалить бронь", callback_data="remove")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     if update.callback_query:
         message = await update.callback_query.message.reply_text(
-            "Выберите действие:", reply_markup=reply_markup
+            text, reply_markup=reply_markup
         )
     else:
-        message = await update.message.reply_text(
-            "Выберите действие:", reply_markup=reply_markup
-        )
+        message = await update.message.reply_text(text, reply_markup=reply_markup)
 
-    context.job_queue.run_once(
-        delete_message,
-        60,
-        data={"chat_id": message.chat.id, "message_id": message.message_id},
-    )
+    delete_later(context, message.chat.id, message.message_id, 60)
 
     if update.message:
-        context.job_queue.run_once(
-            delete_message,
-            5,
-            data={
-                "chat_id": update.message.chat.id,
-                "message_id": update.message.message_id,
-            },
-        )
+        delete_later(context, update.message.chat.id, update.message.message_id, 5)
+
+
+def delete_later(context: ContextTypes.DEFAULT_TYPE, chat_id, message_id, delay):
+    context.bot_data["sweeper"].schedule(chat_id, message_id, delay)
 
 
-async def delete_message(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.data["chat_id"]
-    message_id = job.data["message_id"]
+async def sweep_messages(context: ContextTypes.DEFAULT_TYPE):
+    await context.bot_data["sweeper"].sweep()
 
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except telegram.error.BadRequest:
-        pass
+
+async def choose_lot(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
+    user_id = update.callback_query.from_user.id
+    await update.callback_query.edit_message_text(
+        "Выберите парковку:", reply_markup=views.lot_keyboard(available_lots(user_id))
+    )
 
 
 async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -140,7 +259,7 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>Перманентное бронирование:</b>\n"
         "Вы можете забронировать место на определенные дни недели. Учтите, что у вас может быть не более трех перманентных броней одновременно и не может быть большой одной перманентной брони на день.\n\n"
         "<b>Временное бронирование:</b>\n"
-        "Вы можете временно забронировать свободное место. Временные брони действуют только на одну неделю, после чего место автоматически становится доступным для других пользователей или владение бронью возвращается тому, кто ранее перманентно забронировал место. Не может быть большой одной временной брони на день.\n\n"
+        "Вы можете временно забронировать свободное место на любой день ближайших недель: кнопки «Пред. неделя» и «След. неделя» листают недели в меню выбора дня и в расписании. Временная бронь действует только на выбранную дату, после чего место автоматически становится доступным для других пользователей или владение бронью возвращается тому, кто ранее перманентно забронировал место. Не может быть большой одной временной брони на день.\n\n"
         "<b>Удаление брони:</b>\n"
         "Вы можете удалить свои брони (как временные, так и перманентные). Если место было забронировано другим пользователем, вы не сможете его удалить.\n\n"
         "<b>VIP-функции:</b>\n"
@@ -152,441 +271,464 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_message_id = update.message.message_id
     user_chat_id = update.message.chat.id
 
-    context.job_queue.run_once(
-        delete_message, 5, data={"chat_id": user_chat_id, "message_id": user_message_id}
-    )
+    delete_later(context, user_chat_id, user_message_id, 5)
 
     await update.message.reply_text(help_text, parse_mode="HTML")
 
 
-async def schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    schedule = get_schedule()
-    today = datetime.date.today()
+_schedule_html_cache = {}
 
-    russian_days = [
-        "Понедельник",
-        "Вторник",
-        "Среда",
-        "Четверг",
-        "Пятница",
-        "Суббота",
-        "Воскресенье",
-    ]
-    monday = today - datetime.timedelta(days=today.weekday())
 
-    response = "Расписание:\n"
+def render_schedule_day(lot, date, schedule, version):
+    places = access.places(lot)
+    cache_key = (version, places)
+    cache = _schedule_html_cache.get(lot)
+    if cache is None or cache["key"] != cache_key:
+        cache = {"key": cache_key, "days": {}}
+        _schedule_html_cache[lot] = cache
+
+    rendered = cache["days"].get(date)
+    if rendered is not None:
+        return rendered
+
+    day_name = RUSSIAN_DAYS[date.weekday()]
+    underline_length = 30
+    rendered = f"{'-' * underline_length}\n"
+    rendered += f"<i><b>{day_name}</b></i> ({date.strftime('%d-%m-%Y')}):\n"
+
+    for place in places:
+        booking = schedule.get(date, {}).get(place, None)
+        # Названия мест задает администратор, поэтому они экранируются для
+        # parse_mode="HTML".
+        name = html.escape(place)
+        if len(str(place)) == 2:
+            space_padding = "   "
+        elif len(str(place)) == 3:
+            space_padding = " "
+        else:
+            space_padding = " "
+
+        if booking is None:
+            rendered += f"  Место {name}{space_padding}: ✅ Свободно\n"
+        else:
+            user = booking["user"]
+            booking_status = "Временная" if booking["is_temp"] else "Перманентная"
+            rendered += (
+                f"  Место {name}{space_padding}: ❌ (@{user}, {booking_status})\n"
+            )
+
+    cache["days"][date] = rendered
+    return rendered
+
+
+async def schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    lot = payload.lot
+    week = payload.week or 0
+    start = datetime.date.today() + datetime.timedelta(weeks=week)
+    version, schedule = await get_schedule_snapshot(lot, start)
+
+    if len(access.lots) > 1:
+        response = f"Расписание ({html.escape(access.title(lot))}):\n"
+    else:
+        response = "Расписание:\n"
 
     for i in range(7):
-        date = monday + datetime.timedelta(days=i)
-        day_name = russian_days[i]
-
-        if date < today:
-            date += datetime.timedelta(weeks=1)
-
-        underline_length = 30
-        response += f"{'-' * underline_length}\n"
-        response += f"<i><b>{
-            day_name}</b></i> ({date.strftime('%d-%m-%Y')}):\n"
-
-        for place in PLACES:
-            user = schedule.get(day_name, {}).get(place, None)
-            if len(str(place)) == 2:
-                space_padding = "   "
-            elif len(str(place)) == 3:
-                space_padding = " "
-            else:
-                space_padding = " "
-
-            if user is None:
-                response += f"  Место {place}{space_padding}: ✅ Свободно\n"
-            else:
-                booking_status = check_is_permtemp_status(place, user, day_name)
-                response += f"  Место {place}{
-                    space_padding}: ❌ (@{user}, {booking_status})\n"
+        response += render_schedule_day(lot, next_date(i, week), schedule, version)
 
     await update.callback_query.message.delete()
-    await update.callback_query.message.reply_text(response, parse_mode="HTML")
+    await update.callback_query.message.reply_text(
+        response,
+        parse_mode="HTML",
+        reply_markup=views.schedule_keyboard(lot, week),
+    )
 
 
-async def book(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    today = datetime.date.today()
-    monday = today - datetime.timedelta(days=today.weekday())
-
-    russian_days = [
-        "Понедельник",
-        "Вторник",
-        "Среда",
-        "Четверг",
-        "Пятница",
-        "Суббота",
-        "Воскресенье",
-    ]
+async def free_counts(lot, week=None):
+    # Количество свободных мест на каждый день недели для меню выбора дня.
+    return await get_free_counts(
+        lot, access.places(lot), [next_date(i, week) for i in range(7)]
+    )
 
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                russian_days[i],
-                callback_data=f"choose_day_{
-                                      russian_days[i]}",
-            )
-        ]
-        for i in range(7)
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
+async def book(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
     await update.callback_query.edit_message_text(
-        "Выберите день для бронирования:", reply_markup=reply_markup
+        "Выберите день для бронирования:",
+        reply_markup=views.day_keyboard(
+            payload.lot,
+            callbacks.CHOOSE_DAY,
+            free_counts=await free_counts(payload.lot),
+        ),
     )
 
 
-async def temp_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    today = datetime.date.today()
-    monday = today - datetime.timedelta(days=today.weekday())
-
-    russian_days = [
-        "Понедельник",
-        "Вторник",
-        "Среда",
-        "Четверг",
-        "Пятница",
-        "Суббота",
-        "Воскресенье",
-    ]
-
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                russian_days[i],
-                callback_data=f"choose_temp_day_{
-                                      russian_days[i]}",
-            )
-        ]
-        for i in range(7)
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
+async def temp_book(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    week = payload.week or 0
     await update.callback_query.edit_message_text(
-        "Выберите день для временного бронирования:", reply_markup=reply_markup
+        f"Выберите день для временного бронирования ({week_range(week)}):",
+        reply_markup=views.day_keyboard(
+            payload.lot,
+            callbacks.CHOOSE_TEMP_DAY,
+            week,
+            await free_counts(payload.lot, week),
+        ),
     )
 
 
-async def choose_temp_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    day = update.callback_query.data.split("_")[3]
-    context.user_data["selected_temp_day"] = day
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                f"Место {place}",
-                callback_data=f"temp_book_{
-                                      day}_{place}",
+async def handle_any_booking(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, payload
+):
+    lot = payload.lot
+    user_id = update.callback_query.from_user.id
+    date = next_date(payload.day, payload.week)
+
+    # Сначала предлагаются места, на которые пользователь подписан.
+    current = await get_subscriptions(lot, user_id)
+    place = await pick_free_place(lot, access.places(lot), date, current["places"])
+    if place is None:
+        reply_markup = None
+        if payload.action == callbacks.TEMP_BOOK_ANY:
+            reply_markup = views.waitlist_keyboard(
+                lot, callbacks.JOIN_WAITLIST, payload.day, payload.week
             )
-        ]
-        for place in PLACES
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        message = await update.callback_query.message.reply_text(
+            f"❌ На {RUSSIAN_DAYS[payload.day]} ({date}) нет свободных мест.",
+            reply_markup=reply_markup,
+        )
+        delete_later(context, message.chat.id, message.message_id, 20)
+        return
+
+    # Выбранное место бронируется обычным обработчиком, который в одной
+    # транзакции еще раз проверяет, что место свободно.
+    if payload.action == callbacks.BOOK_ANY:
+        await handle_booking(update, context, payload._replace(place=place))
+    else:
+        await handle_temp_booking(update, context, payload._replace(place=place))
+
+
+async def choose_temp_day(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    day = RUSSIAN_DAYS[payload.day]
+    week = payload.week or 0
+    reply_markup = views.place_keyboard(
+        payload.lot, callbacks.TEMP_BOOK_PLACE, payload.day, week
+    )
     await update.callback_query.edit_message_text(
-        f"Выберите место для временного бронирования на {day}:",
+        f"Выберите место для временного бронирования на {day} ({next_date(payload.day, week)}):",
         reply_markup=reply_markup,
     )
 
 
-async def handle_temp_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = update.callback_query.data.split("_")
-    day = data[2]
-    place = data[3]
+async def handle_temp_booking(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, payload
+):
+    lot = payload.lot
+    day = RUSSIAN_DAYS[payload.day]
+    place = payload.place
     user_id = update.callback_query.from_user.id
     username = update.callback_query.from_user.username
 
-    today = datetime.date.today()
-    russian_days = [
-        "Понедельник",
-        "Вторник",
-        "Среда",
-        "Четверг",
-        "Пятница",
-        "Суббота",
-        "Воскресенье",
-    ]
-    day_index = russian_days.index(day)
-    monday = today - datetime.timedelta(days=today.weekday())
-    reservation_date = monday + datetime.timedelta(days=day_index)
-
-    if reservation_date < today:
-        reservation_date += datetime.timedelta(days=7)
-
-    restore_date = reservation_date
+    reservation_date = next_date(payload.day, payload.week)
 
-    user_permanent_booking = get_permanent_booking_for_day(username, day)
-
-    if user_permanent_booking:
-        permanent_place = user_permanent_booking["place"]
-        message = await update.callback_query.message.reply_text(
-            f"❌ У вас уже забронировано место {permanent_place} на {day}. "
-            f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
-        )
-        return
+    outcome = await book_temporary(
+        lot, place, username, reservation_date, access.is_vip(lot, user_id)
+    )
+    status = outcome["status"]
 
-    user_temp_booking = get_user_temp_booking_for_day(username, day)
-    if user_temp_booking:
-        temp_place = user_temp_booking["place"]
+    if status in ("has_permanent", "has_temp"):
+        if status == "has_permanent":
+            text = f"❌ У вас уже забронировано место {outcome['place']} на {day}. "
+        else:
+            text = f"❌ У вас уже временно забронировано место {outcome['place']} на {day}. "
         message = await update.callback_query.message.reply_text(
-            f"❌ У вас уже временно забронировано место {temp_place} на {day}. "
-            f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
+            text + f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
         )
+        delete_later(context, message.chat.id, message.message_id, 20)
         return
 
-    booked_user, is_temp_booking = get_temp_booked_places(place, day)
-
-    if booked_user is None:
-        create_temp_booking(place, username, reservation_date, restore_date, day)
+    if status == "booked":
         await notify_users(
             context,
+            lot,
             f"✅ Пользователь @{username} временно забронировал место {place} на {reservation_date}.",
+            place,
+            payload.day,
         )
         message = await update.callback_query.message.reply_text(
             f"✅ Успешно временно забронировано: место {place} на {reservation_date}."
         )
-    elif user_id in VIP_USERS:
-        if is_temp_booking:
-            delete_temp_booking(place, booked_user, reservation_date)
-            delete_temp_bookings_from_temp_handler(place, booked_user, day)
-
-        create_temp_booking(place, username, reservation_date, restore_date, day)
+    elif status == "overridden":
+        booked_user = outcome["previous_user"]
         await notify_users(
             context,
+            lot,
             f"✅ VIP @{username} временно забронировал место {place} на {reservation_date}, которое было ранее забронировано пользователем @{booked_user}.",
+            place,
+            payload.day,
         )
         message = await update.callback_query.message.reply_text(
             f"✅ Успешно временно забронировано: место {place} на {reservation_date} (ранее забронировано пользователем @{booked_user})."
         )
     else:
-        if is_temp_booking:
+        booked_user = outcome["booked_user"]
+        # Занятое место можно дождаться в очереди: при освобождении оно
+        # будет забронировано автоматически.
+        reply_markup = views.waitlist_keyboard(
+            lot, callbacks.JOIN_WAITLIST, payload.day, payload.week or 0, place
+        )
+        if outcome["is_temp"]:
             message = await update.callback_query.message.reply_text(
-                f"❌ Место {place} уже временно забронировано пользователем @{booked_user} на {reservation_date}."
+                f"❌ Место {place} уже временно забронировано пользователем @{booked_user} на {reservation_date}.",
+                reply_markup=reply_markup,
             )
         else:
             message = await update.callback_query.message.reply_text(
-                f"❌ Место {place} уже забронировано пользователем @{booked_user} на {reservation_date}."
+                f"❌ Место {place} уже забронировано пользователем @{booked_user} на {reservation_date}.",
+                reply_markup=reply_markup,
             )
 
-    context.job_queue.run_once(
-        delete_message,
-        20,
-        data={"chat_id": message.chat.id, "message_id": message.message_id},
-    )
+    delete_later(context, message.chat.id, message.message_id, 20)
     await update.callback_query.message.delete()
 
 
-async def choose_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    day = update.callback_query.data.split("_")[2]
-    context.user_data["selected_day"] = day
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                f"Место {place}",
-                callback_data=f"book_{
-                                      day}_{place}",
+def notify_waiters(context, lot, assigned):
+    # Место из очереди получает один пользователь, поэтому уведомление
+    # отправляется только ему, без рассылки подписчикам.
+    for assignment in assigned:
+        if not access.is_authorized(lot, assignment["user_id"]):
+            continue
+        message = (
+            f"✅ Освободилось место {assignment['place']} на {assignment['date']}. "
+            "Оно забронировано за вами из очереди."
+        )
+        if len(access.lots) > 1:
+            message = f"{access.title(lot)}: {message}"
+        context.bot_data["broadcaster"].enqueue([assignment["user_id"]], message)
+
+
+async def handle_waitlist(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    lot = payload.lot
+    user_id = update.callback_query.from_user.id
+    username = update.callback_query.from_user.username
+    date = next_date(payload.day, payload.week)
+    place = payload.place or ""
+    target = f"место {payload.place}" if payload.place else "любое место"
+    leave_markup = views.waitlist_keyboard(
+        lot, callbacks.LEAVE_WAITLIST, payload.day, payload.week, payload.place
+    )
+    reply_markup = None
+
+    if payload.action == callbacks.LEAVE_WAITLIST:
+        if await leave_waitlist(lot, date, place, user_id):
+            text = f"✅ Вы вышли из очереди на {target} на {date}."
+        else:
+            text = f"❌ Вы не стоите в очереди на {target} на {date}."
+    else:
+        outcome = await join_waitlist(lot, date, place, username, user_id)
+        status = outcome["status"]
+        if status == "joined":
+            text = (
+                f"🕒 Вы в очереди на {target} на {date}, позиция {outcome['position']}. "
+                "Когда место освободится, оно будет забронировано за вами автоматически."
             )
-        ]
-        for place in PLACES
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = leave_markup
+        elif status == "already_waiting":
+            text = f"🕒 Вы уже в очереди на {target} на {date}, позиция {outcome['position']}."
+            reply_markup = leave_markup
+        elif status == "free":
+            text = f"✅ На {date} {target} уже свободно, забронируйте его."
+        else:
+            text = f"❌ У вас уже есть бронь на {date}: место {outcome['place']}."
+
+    message = await update.callback_query.message.reply_text(
+        text, reply_markup=reply_markup
+    )
+    delete_later(context, message.chat.id, message.message_id, 60)
+
+
+async def choose_day(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    day = RUSSIAN_DAYS[payload.day]
+    reply_markup = views.place_keyboard(payload.lot, callbacks.BOOK_PLACE, payload.day)
     await update.callback_query.edit_message_text(
         f"Выберите место для бронирования на {day}:", reply_markup=reply_markup
     )
 
 
-async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    today = datetime.date.today()
-    monday = today - datetime.timedelta(days=today.weekday())
-
-    russian_days = [
-        "Понедельник",
-        "Вторник",
-        "Среда",
-        "Четверг",
-        "Пятница",
-        "Суббота",
-        "Воскресенье",
-    ]
+async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    week = payload.week or 0
+    await update.callback_query.edit_message_text(
+        f"Выберите день для удаления брони ({week_range(week)}):",
+        reply_markup=views.day_keyboard(payload.lot, callbacks.CHOOSE_REMOVE_DAY, week),
+    )
 
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                russian_days[i],
-                callback_data=f"choose_remove_day_{
-                                      russian_days[i]}",
-            )
-        ]
-        for i in range(7)
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+
+async def choose_remove_day(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, payload
+):
+    day = RUSSIAN_DAYS[payload.day]
+    week = payload.week or 0
+    reply_markup = views.place_keyboard(
+        payload.lot, callbacks.REMOVE_PLACE, payload.day, week
+    )
     await update.callback_query.edit_message_text(
-        "Выберите день для удаления брони:", reply_markup=reply_markup
+        f"Выберите место для удаления брони на {day} ({next_date(payload.day, week)}):",
+        reply_markup=reply_markup,
     )
 
 
-async def choose_remove_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    day = update.callback_query.data.split("_")[3]
-    context.user_data["remove_day"] = day
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                f"Место {place}",
-                callback_data=f"remove_{
-                                      day}_{place}",
-            )
-        ]
-        for place in PLACES
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    user_id = update.callback_query.from_user.id
+    current = await get_subscriptions(payload.lot, user_id)
+
     await update.callback_query.edit_message_text(
-        f"Выберите место для удаления брони на {day}:", reply_markup=reply_markup
+        "Выберите, о каких изменениях присылать уведомления:",
+        reply_markup=views.subscriptions_keyboard(payload.lot, current),
     )
 
 
-async def handle_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = update.callback_query.data.split("_")
-    day = data[1]
-    place = data[2]
+async def handle_subscription(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, payload
+):
+    lot = payload.lot
     user_id = update.callback_query.from_user.id
-    username = update.callback_query.from_user.username
 
-    user_permanent_booking = get_permanent_booking_for_day(username, day)
+    if payload.action == callbacks.SUBS_ALL:
+        await set_subscription_mode(lot, user_id, "all")
+    elif payload.action == callbacks.SUBS_NONE:
+        await set_subscription_mode(lot, user_id, "none")
+    elif payload.action == callbacks.SUBS_FREED:
+        await toggle_subscription(lot, user_id, "freed")
+    elif payload.action == callbacks.SUBS_MODE:
+        if payload.value < len(NOTIFICATION_MODES):
+            await set_notification_mode(user_id, NOTIFICATION_MODES[payload.value])
+    elif payload.action == callbacks.SUBS_PLACE:
+        await toggle_subscription(lot, user_id, "place", payload.place)
+    elif payload.action == callbacks.SUBS_DAY:
+        await toggle_subscription(lot, user_id, "day", str(payload.day))
+
+    await subscriptions(update, context, payload)
+
+
+async def handle_booking(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    lot = payload.lot
+    day = RUSSIAN_DAYS[payload.day]
+    place = payload.place
+    user_id = update.callback_query.from_user.id
+    username = update.callback_query.from_user.username
 
-    if user_permanent_booking:
-        permanent_place = user_permanent_booking["place"]
-        message = await update.callback_query.message.reply_text(
-            f"❌ У вас уже забронировано место {permanent_place} на {day}. "
-            f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
-        )
-        return
+    outcome = await book_permanent(
+        lot, place, username, next_date(payload.day), access.is_vip(lot, user_id)
+    )
+    status = outcome["status"]
 
-    user_temp_booking = get_user_temp_booking_for_day(username, day)
-    if user_temp_booking:
-        temp_place = user_temp_booking["place"]
-        message = await update.callback_query.message.reply_text(
-            f"❌ У вас уже временно забронировано место {temp_place} на {day}. "
-            f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
-        )
+    if status in ("has_permanent", "has_temp", "limit_reached", "taken"):
+        if status == "has_permanent":
+            text = (
+                f"❌ У вас уже забронировано место {outcome['place']} на {day}. "
+                f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
+            )
+        elif status == "has_temp":
+            text = (
+                f"❌ У вас уже временно забронировано место {outcome['place']} на {outcome['date']}. "
+                f"Удалите эту бронь, чтобы забронировать место {place} на {day}."
+            )
+        elif status == "limit_reached":
+            text = (
+                f"❌ У вас уже {outcome['count']} перманентные брони. "
+                f"Удалите одну из них, чтобы забронировать место {place} на {day}."
+            )
+        else:
+            text = f"❌ Место {place} уже забронировано пользователем @{outcome['booked_user']} на {day}."
+        message = await update.callback_query.message.reply_text(text)
+        delete_later(context, message.chat.id, message.message_id, 20)
         return
 
-    booked_user = get_booked_places(place, day)
-
-    if booked_user and user_id in VIP_USERS:
-        delete_booking(place, day)
-        create_booking(place, username, day)
+    if status == "overridden":
         await notify_users(
             context,
-            f"✅ VIP @{username} забронировал место {place} на {day}, которое было ранее забронировано пользователем @{booked_user}.",
-        )
-    elif booked_user is None:
-        create_booking(place, username, day)
-        await notify_users(
-            context, f"✅ Пользователь @{username} забронировал место {place} на {day}."
+            lot,
+            f"✅ VIP @{username} забронировал место {place} на {day}, которое было ранее забронировано пользователем @{outcome['previous_user']}.",
+            place,
+            payload.day,
         )
     else:
-        message = await update.callback_query.message.reply_text(
-            f"❌ Место {place} уже забронировано пользователем @{booked_user} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
+        await notify_users(
+            context,
+            lot,
+            f"✅ Пользователь @{username} забронировал место {place} на {day}.",
+            place,
+            payload.day,
         )
-        return
 
     await update.callback_query.message.delete()
     message_success = await update.callback_query.message.reply_text(
         f"✅ Успешно забронировано: место {place} на {day}."
     )
-    context.job_queue.run_once(
-        delete_message,
-        20,
-        data={
-            "chat_id": message_success.chat.id,
-            "message_id": message_success.message_id,
-        },
-    )
+    delete_later(context, message_success.chat.id, message_success.message_id, 20)
 
 
-async def handle_removal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_removal(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    lot = payload.lot
     user_id = update.callback_query.from_user.id
     username = update.callback_query.from_user.username
-    day = context.user_data.get("remove_day")
-    place = update.callback_query.data.split("_")[2]
-
-    booked_user = get_booked_places(place, day)
-    temp_booked_info = get_temp_booked_info(place, day)
-
-    if user_id in VIP_USERS:
-        original_user = temp_booked_info.get("original_user", None)
-        temp_user = temp_booked_info.get("user", None)
-
-        if original_user and temp_user == username and original_user != username:
-            restore_bookings_manually(place, day)
+    day = RUSSIAN_DAYS[payload.day]
+    place = payload.place
+
+    outcome = await remove_place_booking(
+        lot,
+        place,
+        username,
+        next_date(payload.day, payload.week),
+        access.is_vip(lot, user_id),
+    )
+    status = outcome["status"]
+
+    # После удаления временной брони на эту дату снова действует
+    # перманентная бронь, если она есть.
+    restored = ""
+    if outcome.get("restored_user"):
+        restored = (
+            f" Место снова занято перманентной бронью @{outcome['restored_user']}."
+        )
 
-        remove_booking(place, booked_user, day, manually_deleted=False)
+    if status == "removed_by_vip":
         await notify_users(
             context,
-            f"❌ VIP @{username} удалил бронь с места {place}, ранее забронированное пользователем @{booked_user} на {day}.",
+            lot,
+            f"❌ VIP @{username} удалил бронь с места {place}, ранее забронированное пользователем @{outcome['booked_user']} на {day}.",
+            place,
+            payload.day,
+            released=outcome["released"],
         )
+        notify_waiters(context, lot, outcome["assigned"])
         message_success = await update.callback_query.message.reply_text(
-            f"✅ Успешно удалено: место {place} на {day}."
-        )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={
-                "chat_id": message_success.chat.id,
-                "message_id": message_success.message_id,
-            },
+            f"✅ Успешно удалено: место {place} на {day}.{restored}"
         )
+        delete_later(context, message_success.chat.id, message_success.message_id, 20)
 
-    elif booked_user == username:
-        remove_booking(place, booked_user, day, manually_deleted=True)
-
-        if temp_booked_info:
+    elif status == "removed":
+        if outcome["was_temp"]:
             message_success = await update.callback_query.message.reply_text(
-                f"✅ Вы удалили свою бронь на {place} на {day}"
+                f"✅ Вы удалили свою бронь на {place} на {day}.{restored}"
             )
         else:
             message_success = await update.callback_query.message.reply_text(
                 f"✅ Успешно удалено: место {place} на {day}."
             )
 
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={
-                "chat_id": message_success.chat.id,
-                "message_id": message_success.message_id,
-            },
-        )
+        delete_later(context, message_success.chat.id, message_success.message_id, 20)
         await notify_users(
             context,
+            lot,
             f"❌ Пользователь @{username} удалил свою бронь на {place} на {day}.",
+            place,
+            payload.day,
+            released=outcome["released"],
+        )
+        notify_waiters(context, lot, outcome["assigned"])
+    elif status == "not_booked":
+        message = await update.callback_query.message.reply_text(
+            f"❌ Место {place} на {day} не забронировано."
         )
+        delete_later(context, message.chat.id, message.message_id, 20)
     else:
         await update.callback_query.answer(
             f"Вы не можете удалить бронь на место {place} на день {day}, так как оно забронировано другим пользователем."
@@ -594,59 +736,283 @@ async def handle_removal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message = await update.callback_query.message.reply_text(
             f"❌ Ошибка: место {place} уже забронировано другим пользователем."
         )
-        context.job_queue.run_once(
-            delete_message,
-            20,
-            data={"chat_id": message.chat.id, "message_id": message.message_id},
-        )
+        delete_later(context, message.chat.id, message.message_id, 20)
 
     await update.callback_query.message.delete()
 
 
+async def reply_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    message = await update.message.reply_text(text)
+    delete_later(context, message.chat.id, message.message_id, 20)
+    delete_later(context, update.message.chat.id, update.message.message_id, 5)
+
+
+async def get_admin_lot(user_id):
+    # Команды администратора относятся к парковке, выбранной им в /start.
+    lot = await get_user_lot(user_id)
+    return lot if lot in access.lots else access.lots[0]
+
+
+async def add_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+
+    args = context.args
+    if (
+        not args
+        or len(args) > 2
+        or not args[0].isdigit()
+        or (len(args) == 2 and args[1] not in ("vip", "whitelist"))
+    ):
+        await reply_to_admin(
+            update, context, "Использование: /add_user <id> [vip|whitelist]"
+        )
+        return
+
+    lot = await get_admin_lot(update.message.from_user.id)
+    user_id = int(args[0])
+    role = args[1] if len(args) == 2 else "whitelist"
+    await set_user_role(lot, user_id, role)
+    apply_access(*await load_access())
+    await reply_to_admin(
+        update,
+        context,
+        f"✅ Пользователь {user_id} добавлен ({role}) на парковку {access.title(lot)}.",
+    )
+
+
+async def remove_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+
+    args = context.args
+    if len(args) != 1 or not args[0].isdigit():
+        await reply_to_admin(update, context, "Использование: /remove_user <id>")
+        return
+
+    lot = await get_admin_lot(update.message.from_user.id)
+    user_id = int(args[0])
+    if await remove_user(lot, user_id):
+        apply_access(*await load_access())
+        await reply_to_admin(
+            update,
+            context,
+            f"✅ Пользователь {user_id} удален с парковки {access.title(lot)}.",
+        )
+    else:
+        await reply_to_admin(
+            update,
+            context,
+            f"❌ Пользователь {user_id} не найден на парковке {access.title(lot)}.",
+        )
+
+
+async def add_place_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+
+    if len(context.args) != 1:
+        await reply_to_admin(update, context, "Использование: /add_place <место>")
+        return
+
+    lot = await get_admin_lot(update.message.from_user.id)
+    place = context.args[0]
+    if await add_place(lot, place):
+        apply_access(*await load_access())
+        await reply_to_admin(
+            update,
+            context,
+            f"✅ Место {place} добавлено на парковку {access.title(lot)}.",
+        )
+    else:
+        await reply_to_admin(
+            update,
+            context,
+            f"❌ Место {place} уже есть на парковке {access.title(lot)}.",
+        )
+
+
+async def remove_place_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+
+    if len(context.args) != 1:
+        await reply_to_admin(update, context, "Использование: /remove_place <место>")
+        return
+
+    lot = await get_admin_lot(update.message.from_user.id)
+    place = context.args[0]
+    outcome = await remove_place(lot, place)
+    if outcome["status"] == "removed":
+        apply_access(*await load_access())
+        await reply_to_admin(
+            update, context, f"✅ Место {place} удалено с парковки {access.title(lot)}."
+        )
+    elif outcome["status"] == "has_bookings":
+        await reply_to_admin(
+            update,
+            context,
+            f"❌ На место {place} есть брони ({outcome['count']}). Удалите их, чтобы удалить место.",
+        )
+    else:
+        await reply_to_admin(
+            update,
+            context,
+            f"❌ Место {place} не найдено на парковке {access.title(lot)}.",
+        )
+
+
+async def access_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return
+
+    lot = await get_admin_lot(update.message.from_user.id)
+    _, users, places = await load_access()
+    vip_users = sorted(
+        user_id
+        for user_lot, user_id, role in users
+        if user_lot == lot and role == "vip"
+    )
+    whitelist_users = sorted(
+        user_id
+        for user_lot, user_id, role in users
+        if user_lot == lot and role == "whitelist"
+    )
+    await reply_to_admin(
+        update,
+        context,
+        f"Парковка: {access.title(lot)}\n"
+        "VIP: " + ", ".join(map(str, vip_users)) + "\n"
+        "Пользователи: " + ", ".join(map(str, whitelist_users)) + "\n"
+        "Места: " + ", ".join(places.get(lot, [])),
+    )
+
+
+router.register(callbacks.SCHEDULE, schedule, requires=("lot",))
+router.register(callbacks.BOOK, book, requires=("lot",))
+router.register(callbacks.CHOOSE_DAY, choose_day, requires=("lot", "day"))
+router.register(callbacks.BOOK_PLACE, handle_booking, requires=("lot", "day", "place"))
+router.register(callbacks.TEMP_BOOK, temp_book, requires=("lot",))
+router.register(callbacks.CHOOSE_TEMP_DAY, choose_temp_day, requires=("lot", "day"))
+router.register(
+    callbacks.TEMP_BOOK_PLACE, handle_temp_booking, requires=("lot", "day", "place")
+)
+router.register(callbacks.REMOVE, remove, requires=("lot",))
+router.register(callbacks.CHOOSE_REMOVE_DAY, choose_remove_day, requires=("lot", "day"))
+router.register(
+    callbacks.REMOVE_PLACE, handle_removal, requires=("lot", "day", "place")
+)
+router.register(callbacks.SUBSCRIPTIONS, subscriptions, requires=("lot",))
+router.register(callbacks.SUBS_ALL, handle_subscription, requires=("lot",))
+router.register(callbacks.SUBS_NONE, handle_subscription, requires=("lot",))
+router.register(callbacks.SUBS_FREED, handle_subscription, requires=("lot",))
+router.register(callbacks.SUBS_PLACE, handle_subscription, requires=("lot", "place"))
+router.register(callbacks.SUBS_DAY, handle_subscription, requires=("lot", "day"))
+router.register(callbacks.SUBS_MODE, handle_subscription, requires=("lot", "value"))
+router.register(callbacks.BACK, start)
+router.register(callbacks.CHOOSE_LOT, choose_lot)
+router.register(callbacks.SELECT_LOT, start, requires=("lot",))
+router.register(callbacks.BOOK_ANY, handle_any_booking, requires=("lot", "day"))
+router.register(
+    callbacks.TEMP_BOOK_ANY, handle_any_booking, requires=("lot", "day", "week")
+)
+router.register(
+    callbacks.JOIN_WAITLIST, handle_waitlist, requires=("lot", "day", "week")
+)
+router.register(
+    callbacks.LEAVE_WAITLIST, handle_waitlist, requires=("lot", "day", "week")
+)
+
+
+def can_use(lot, user_id):
+    # Доступ проверяется при каждом нажатии: пользователь, удаленный
+    # администратором, не может пользоваться уже отправленными кнопками.
+    if lot is None:
+        return bool(available_lots(user_id))
+    return is_admin(user_id) or is_authorized(lot, user_id)
+
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    payload = router.decode(query.data)
+    if payload is None:
+        await query.answer("Кнопка устарела. Откройте меню заново командой /start.")
+        return
+
+    if not can_use(payload.lot, query.from_user.id):
+        await query.answer("У вас нет доступа для использования этого бота.")
+        return
 
-    if query.data == "schedule":
-        await schedule(update, context)
-    elif query.data == "book":
-        await book(update, context)
-    elif query.data.startswith("choose_day_"):
-        await choose_day(update, context)
-    elif query.data == "remove":
-        await remove(update, context)
-    elif query.data.startswith("choose_remove_day_"):
-        await choose_remove_day(update, context)
-    elif query.data.startswith("book_"):
-        await handle_booking(update, context)
-    elif query.data.startswith("remove_"):
-        await handle_removal(update, context)
-    elif query.data == "temp_book":
-        await temp_book(update, context)
-    elif query.data.startswith("choose_temp_day_"):
-        await choose_temp_day(update, context)
-    elif query.data.startswith("temp_book_"):
-        await handle_temp_booking(update, context)
-    elif query.data == "back":
-        await start(update, context)
+    await router.dispatch(update, context, payload)
 
 
 async def clear_webhook(application):
     await application.bot.delete_webhook(drop_pending_updates=True)
 
 
-def main():
-    init_db()
-    create_temp_bookings_table()
-    restore_bookings()
+async def on_startup(application):
+    broadcaster = Broadcaster(
+        application.bot,
+        workers=BROADCAST_WORKERS,
+        rate=BROADCAST_RATE,
+        chat_interval=BROADCAST_CHAT_INTERVAL,
+        max_retries=BROADCAST_MAX_RETRIES,
+        coalesce_window=NOTIFY_COALESCE_SECONDS,
+    )
+    broadcaster.start()
+    application.bot_data["broadcaster"] = broadcaster
+    sweeper = MessageSweeper(application.bot)
+    sweeper.load(await load_pending_deletions())
+    application.bot_data["sweeper"] = sweeper
+
 
-    application = Application.builder().token(API_TOKEN).build()
+async def on_shutdown(application):
+    await application.bot_data["broadcaster"].stop()
+    shutdown_executor()
+
+
+def main():
+    migrate()
+    # Календарь занятости сдвигается до запуска обработчиков, даже если бот
+    # был остановлен во время смены дня.
+    roll_calendar()
+    seed_access_tables(LOTS)
+    apply_access(*load_access_sync())
+    ensure_default_subscriptions(list(access.members))
+
+    application = (
+        Application.builder()
+        .token(API_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     application.job_queue.run_once(
         lambda _: asyncio.create_task(clear_webhook(application)), when=0
     )
 
+    application.job_queue.run_daily(send_digests, time=DIGEST_TIME)
+    application.job_queue.run_daily(expire_bookings, time=ROLLOVER_TIME)
+    application.job_queue.run_repeating(sweep_messages, interval=SWEEP_INTERVAL)
+    application.job_queue.run_repeating(reload_access, interval=ACCESS_RELOAD_INTERVAL)
+
+    # Если бот был остановлен во время смены дня или сводки, пропущенные
+    # задачи выполняются сразу при запуске.
+    job_runs = get_job_runs()
+    if is_job_missed(job_runs.get("expire_bookings"), ROLLOVER_TIME):
+        application.job_queue.run_once(expire_bookings, when=0)
+
+    if is_job_missed(job_runs.get("send_digests"), DIGEST_TIME):
+        application.job_queue.run_once(send_digests, when=0)
+
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("info", info))
+    application.add_handler(CommandHandler("add_user", add_user_command))
+    application.add_handler(CommandHandler("remove_user", remove_user_command))
+    application.add_handler(CommandHandler("add_place", add_place_command))
+    application.add_handler(CommandHandler("remove_place", remove_place_command))
+    application.add_handler(CommandHandler("access", access_command))
 
     application.add_handler(
         MessageHandler(
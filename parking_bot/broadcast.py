@@ -0,0 +1,158 @@
+import asyncio
+
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+
+def merge_messages(header, messages):
+    chunks = []
+    current = header
+    for message in messages:
+        if len(current) + len(message) + 1 > MessageLimit.MAX_TEXT_LENGTH:
+            chunks.append(current)
+            current = header
+        current += "\n" + message
+    chunks.append(current)
+    return chunks
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Broadcaster:
+    def __init__(
+        self, bot, workers, rate, chat_interval, max_retries, coalesce_window=0
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.coalesce_window = coalesce_window
+        self.blocked_chats = set()
+        self._queue = asyncio.Queue()
+        self._limiter = RateLimiter(rate)
+        self._chat_next_slot = {}
+        self._paused_until = 0.0
+        self._tasks = []
+        self._pending = {}
+        self._flush_handles = {}
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, timeout=10):
+        self.flush_all()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Broadcast stopped with {self._queue.qsize()} unsent messages.")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, chat_ids, text):
+        for chat_id in dict.fromkeys(chat_ids):
+            if chat_id not in self.blocked_chats:
+                self._queue.put_nowait((chat_id, text, 0))
+
+    def notify(self, chat_ids, text):
+        if not self.coalesce_window:
+            self.enqueue(chat_ids, text)
+            return
+
+        loop = asyncio.get_running_loop()
+        for chat_id in dict.fromkeys(chat_ids):
+            if chat_id in self.blocked_chats:
+                continue
+            self._pending.setdefault(chat_id, []).append(text)
+            if chat_id not in self._flush_handles:
+                self._flush_handles[chat_id] = loop.call_later(
+                    self.coalesce_window, self._flush, chat_id
+                )
+
+    def _flush(self, chat_id):
+        self._flush_handles.pop(chat_id, None)
+        messages = self._pending.pop(chat_id, [])
+        if len(messages) == 1:
+            self.enqueue([chat_id], messages[0])
+        elif messages:
+            for text in merge_messages("Изменения бронирований:", messages):
+                self.enqueue([chat_id], text)
+
+    def flush_all(self):
+        for chat_id, handle in list(self._flush_handles.items()):
+            handle.cancel()
+            self._flush(chat_id)
+
+    def unblock(self, chat_id):
+        self.blocked_chats.discard(chat_id)
+
+    def _retry_later(self, chat_id, text, attempt, delay):
+        if attempt >= self.max_retries:
+            print(f"Giving up sending message to {chat_id} after {attempt} attempts.")
+            return
+        asyncio.get_running_loop().call_later(
+            delay, self._queue.put_nowait, (chat_id, text, attempt + 1)
+        )
+
+    async def _wait_for_slot(self, chat_id):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._paused_until, self._chat_next_slot.get(chat_id, 0.0))
+        next_slot = slot + self.chat_interval
+        self._chat_next_slot[chat_id] = next_slot
+        # Прошедший слот больше ничего не ограничивает, поэтому запись чата
+        # удаляется и словарь не растет с каждым новым получателем.
+        loop.call_at(next_slot, self._release_slot, chat_id, next_slot)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self._limiter.wait()
+
+    def _release_slot(self, chat_id, slot):
+        if self._chat_next_slot.get(chat_id) == slot:
+            del self._chat_next_slot[chat_id]
+
+    async def _send(self, chat_id, text, attempt):
+        await self._wait_for_slot(chat_id)
+
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as e:
+            delay = e.retry_after
+            if not isinstance(delay, (int, float)):
+                delay = delay.total_seconds()
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + delay)
+            self._retry_later(chat_id, text, attempt, delay)
+        except Forbidden:
+            print(f"Chat {chat_id} blocked the bot, removing it from broadcasts.")
+            self.blocked_chats.add(chat_id)
+        except BadRequest as e:
+            print(f"Failed to send message to {chat_id}: {e}")
+        except NetworkError:
+            self._retry_later(chat_id, text, attempt, 2**attempt)
+
+    async def _worker(self):
+        while True:
+            chat_id, text, attempt = await self._queue.get()
+            try:
+                if chat_id not in self.blocked_chats:
+                    await self._send(chat_id, text, attempt)
+            except Exception as e:
+                print(f"Unexpected error while sending message to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,136 @@
+import base64
+import binascii
+import struct
+import zlib
+from collections import namedtuple
+
+from config import CALENDAR_WEEKS
+
+# Версия формата callback_data. Кнопки со старой версией считаются устаревшими.
+CALLBACK_VERSION = 3
+
+# Коды действий записываются в callback_data уже отправленных кнопок,
+# поэтому существующие значения нельзя менять, только добавлять новые.
+SCHEDULE = 1
+BOOK = 2
+CHOOSE_DAY = 3
+BOOK_PLACE = 4
+TEMP_BOOK = 5
+CHOOSE_TEMP_DAY = 6
+TEMP_BOOK_PLACE = 7
+REMOVE = 8
+CHOOSE_REMOVE_DAY = 9
+REMOVE_PLACE = 10
+SUBSCRIPTIONS = 11
+SUBS_ALL = 12
+SUBS_NONE = 13
+SUBS_FREED = 14
+SUBS_PLACE = 15
+SUBS_DAY = 16
+SUBS_MODE = 17
+BACK = 18
+CHOOSE_LOT = 19
+SELECT_LOT = 20
+BOOK_ANY = 21
+TEMP_BOOK_ANY = 22
+JOIN_WAITLIST = 23
+LEAVE_WAITLIST = 24
+
+NO_VALUE = 0xFF
+
+# Версия, действие, индекс парковки, день недели, неделя от текущей, индекс
+# места, значение, метка списков парковок и мест.
+_FORMAT = struct.Struct("BBBBBBBB")
+_ENCODED_LENGTH = len(base64.urlsafe_b64encode(bytes(_FORMAT.size)))
+
+CallbackPayload = namedtuple(
+    "CallbackPayload", ["action", "lot", "day", "place", "value", "week"]
+)
+
+
+def _tag(lots, places):
+    return zlib.crc32("\0".join(list(lots) + ["\1"] + list(places)).encode()) & 0xFF
+
+
+class CallbackRouter:
+    def __init__(self, lots):
+        self._routes = {}
+        self.set_lots(lots)
+
+    def set_lots(self, lots):
+        # lots: словарь {парковка: список мест} в порядке меню.
+        self._lots = list(lots)
+        self._lot_index = {lot: i for i, lot in enumerate(self._lots)}
+        self._places = {lot: list(places) for lot, places in lots.items()}
+        self._place_index = {
+            lot: {place: i for i, place in enumerate(places)}
+            for lot, places in self._places.items()
+        }
+        self._tags = {lot: _tag(self._lots, places) for lot, places in lots.items()}
+
+    def register(self, action, handler, requires=()):
+        self._routes[action] = (handler, requires)
+
+    def encode(self, action, lot=None, day=None, place=None, value=None, week=None):
+        raw = _FORMAT.pack(
+            CALLBACK_VERSION,
+            action,
+            NO_VALUE if lot is None else self._lot_index[lot],
+            NO_VALUE if day is None else day,
+            NO_VALUE if week is None else week,
+            NO_VALUE if place is None else self._place_index[lot][place],
+            NO_VALUE if value is None else value,
+            NO_VALUE if lot is None else self._tags[lot],
+        )
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    def decode(self, data):
+        if not data or len(data) != _ENCODED_LENGTH:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(data)
+        except (binascii.Error, ValueError):
+            return None
+        if len(raw) != _FORMAT.size:
+            return None
+
+        version, action, lot, day, week, place, value, tag = _FORMAT.unpack(raw)
+        if version != CALLBACK_VERSION or action not in self._routes:
+            return None
+        if day != NO_VALUE and day > 6:
+            return None
+        # Недели за пределами календаря могли остаться на кнопках после
+        # уменьшения CALENDAR_WEEKS.
+        if week != NO_VALUE and week >= CALENDAR_WEEKS:
+            return None
+
+        if lot == NO_VALUE:
+            lot = None
+        elif lot < len(self._lots) and tag == self._tags[self._lots[lot]]:
+            lot = self._lots[lot]
+        else:
+            # Список парковок или мест парковки изменился после отправки кнопки.
+            return None
+
+        if place == NO_VALUE:
+            place = None
+        elif lot is not None and place < len(self._places[lot]):
+            place = self._places[lot][place]
+        else:
+            return None
+
+        payload = CallbackPayload(
+            action,
+            lot,
+            None if day == NO_VALUE else day,
+            place,
+            None if value == NO_VALUE else value,
+            None if week == NO_VALUE else week,
+        )
+        for field in self._routes[action][1]:
+            if getattr(payload, field) is None:
+                return None
+        return payload
+
+    async def dispatch(self, update, context, payload):
+        await self._routes[payload.action][0](update, context, payload)
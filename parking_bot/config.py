@@ -1,5 +1,35 @@
+import datetime
 import os
 
 API_TOKEN = "PLACE_YOUR_API_TOKEN_HERE"
 VIP_USERS = [123456789, 987654321]
 WHITELIST_USERS = [121212121, 232323232, 343434343]
+ADMIN_USERS = [123456789]
+PLACES = ["13", "303", "304"]
+DEFAULT_LOT = "main"
+LOTS = {
+    DEFAULT_LOT: {
+        "title": "Главный офис",
+        "vip_users": VIP_USERS,
+        "whitelist_users": WHITELIST_USERS,
+        "places": PLACES,
+    },
+}
+DB_PATH = os.getenv("PARKING_BOT_DB_PATH", "database.db")
+DB_POOL_SIZE = int(os.getenv("PARKING_BOT_DB_POOL_SIZE", "4"))
+BROADCAST_WORKERS = 8
+BROADCAST_RATE = 25
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_MAX_RETRIES = 5
+NOTIFY_COALESCE_SECONDS = 30
+DIGEST_TIME = datetime.time(8, 0, tzinfo=datetime.datetime.now().astimezone().tzinfo)
+ROLLOVER_TIME = datetime.time(
+    0, 0, 10, tzinfo=datetime.datetime.now().astimezone().tzinfo
+)
+WRITE_BATCH_SIZE = 64
+SCHEDULE_POLL_INTERVAL = 1
+MIGRATION_BATCH_SIZE = 1000
+MAX_PERMANENT_BOOKINGS = 3
+CALENDAR_WEEKS = 4
+SWEEP_INTERVAL = 1
+ACCESS_RELOAD_INTERVAL = 30
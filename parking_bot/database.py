@@ -1,480 +1,1117 @@
 import sqlite3
-import time
 import datetime
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from availability import Availability
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    WRITE_BATCH_SIZE,
+    SCHEDULE_POLL_INTERVAL,
+    MAX_PERMANENT_BOOKINGS,
+    CALENDAR_WEEKS,
+)
+
+
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, cached_statements=256
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA busy_timeout = 30000")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        # INSERT OR REPLACE вызывает триггеры удаления только при включенных
+        # recursive_triggers, иначе счетчики броней разойдутся с таблицей.
+        connection.execute("PRAGMA recursive_triggers = ON")
+        return connection
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        return self._idle.get()
+
+    def release(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        connection.row_factory = None
+        self._idle.put(connection)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+class DatabaseWriter:
+    def __init__(self, pool, batch_size, poll_interval):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stats = {"batches": 0, "commands": 0, "max_latency": 0.0}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="database-writer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((func, args, kwargs, future, time.monotonic()))
+        return future
+
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _next_batch(self):
+        try:
+            command = self._queue.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return []
+        if command is None:
+            return None
+
+        batch = [command]
+        while len(batch) < self.batch_size:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if command is None:
+                self._queue.put(None)
+                break
+            batch.append(command)
+        return batch
 
+    def _run(self):
+        connection = self.pool._connect()
+        connection.isolation_level = None
+        cursor = connection.cursor()
+        _track_calendar_changes(cursor)
 
-def init_db():
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
-    cursor.execute(
-        """ 
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place TEXT NOT NULL,
-            user TEXT NOT NULL,
-            day TEXT NOT NULL,
-            is_temp BOOLEAN DEFAULT FALSE,
-            manually_deleted BOOLEAN DEFAULT 0
-        )
-    """
-    )
-    connection.commit()
-    connection.close()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                if batch:
+                    self._execute_batch(cursor, batch)
+                else:
+                    # Пока записей нет, поток проверяет, не изменил ли брони
+                    # другой процесс бота.
+                    generation = _read_booking_generation(cursor)
+                    _update_booking_generation(generation, generation)
+        finally:
+            connection.close()
 
+    def _execute_batch(self, cursor, batch):
+        results = []
 
-def create_temp_bookings_table():
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
-    cursor.execute(
-        """ 
-        CREATE TABLE IF NOT EXISTS temp_bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place TEXT NOT NULL,
-            user TEXT NOT NULL,
-            day TEXT NOT NULL,
-            original_user TEXT,
-            reservation_date DATE NOT NULL,
-            restore_date DATE NOT NULL
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            before = _read_booking_generation(cursor)
+            for func, args, kwargs, future, queued_at in batch:
+                cursor.execute("SAVEPOINT command")
+                try:
+                    results.append((future, func(cursor, *args, **kwargs), None))
+                    cursor.execute("RELEASE command")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO command")
+                    cursor.execute("RELEASE command")
+                    results.append((future, None, e))
+            after = _read_booking_generation(cursor)
+            changes = _pop_calendar_changes(cursor)
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if cursor.connection.in_transaction:
+                cursor.execute("ROLLBACK")
+            for _, _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        _update_booking_generation(before, after, changes)
+
+        now = time.monotonic()
+        self.stats["batches"] += 1
+        self.stats["commands"] += len(batch)
+        self.stats["max_latency"] = max(
+            self.stats["max_latency"], max(now - command[4] for command in batch)
         )
-    """
-    )
-    connection.commit()
-    connection.close()
 
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
 
-def get_permanent_booking_for_day(username, day):
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
 
-    try:
-        query = """
-            SELECT place 
-            FROM bookings 
-            WHERE user = ? AND day = ? AND is_temp = 0
-        """
-        cursor.execute(query, (username, day))
-        result = cursor.fetchone()
+_pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+_writer = DatabaseWriter(_pool, WRITE_BATCH_SIZE, SCHEDULE_POLL_INTERVAL)
 
-        if result:
-            return {"place": result["place"]}
-        return None
 
-    except sqlite3.Error as e:
-        print(f"Ошибка при выполнении запроса: {e}")
-        return None
+def write_operation(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return _writer.submit(func, *args, **kwargs).result()
+
+    wrapper.submit = functools.partial(_writer.submit, func)
+    return wrapper
 
-    finally:
-        cursor.close()
-        conn.close()
 
+def get_writer_stats():
+    return dict(_writer.stats)
 
-def get_user_temp_booking_for_day(username, day):
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
 
+@contextmanager
+def get_connection():
+    connection = _pool.acquire()
     try:
-        query = """
-            SELECT place 
-            FROM bookings 
-            WHERE user = ? AND day = ? AND is_temp = 1
-        """
-        cursor.execute(query, (username, day))
-        result = cursor.fetchone()
+        yield connection
+    finally:
+        _pool.release(connection)
 
-        if result:
-            return {"place": result["place"]}
-        return None
 
-    except sqlite3.Error as e:
-        print(f"Ошибка при выполнении запроса: {e}")
-        return None
+def close_connections():
+    _writer.stop()
+    _pool.close()
 
-    finally:
-        cursor.close()
-        conn.close()
 
+_schedule_cache = {
+    "version": 0,
+    "schedules": {},
+    "availability": {},
+    "generation": None,
+}
+_schedule_lock = threading.Lock()
 
-def create_booking(place, user, day):
-    if not user:
-        raise ValueError("User cannot be empty.")
 
-    for attempt in range(5):
-        try:
-            connection = sqlite3.connect("database.db")
-            cursor = connection.cursor()
-            cursor.execute(
-                "INSERT INTO bookings (place, user, day, is_temp) VALUES (?, ?, ?, ?)",
-                (place, user, day, False),
-            )
-            connection.commit()
-            connection.close()
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                time.sleep(1)
-            else:
-                raise e
+def _read_booking_generation(cursor):
+    # Счетчик увеличивают триггеры календаря, поэтому он меняется только
+    # при изменении броней, а не при любой записи в базу.
+    cursor.execute("SELECT generation FROM booking_generation")
+    return cursor.fetchone()[0]
 
 
-def remove_booking(place, user, day, manually_deleted=False):
-    for attempt in range(5):
-        try:
-            connection = sqlite3.connect("database.db")
-            cursor = connection.cursor()
+def _track_calendar_changes(cursor):
+    # Временные триггеры видны только соединению потока записи и запоминают
+    # места и даты, занятость которых изменил текущий пакет. Изменения
+    # откатываются вместе с командой, которая завершилась ошибкой.
+    cursor.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS calendar_changes (
+            lot TEXT NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            PRIMARY KEY (lot, date, place)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TEMP TRIGGER IF NOT EXISTS trg_calendar_changes_insert
+        AFTER INSERT ON main.calendar
+        BEGIN
+            INSERT OR IGNORE INTO calendar_changes (lot, date, place)
+            VALUES (NEW.lot, NEW.date, NEW.place);
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TEMP TRIGGER IF NOT EXISTS trg_calendar_changes_delete
+        AFTER DELETE ON main.calendar
+        BEGIN
+            INSERT OR IGNORE INTO calendar_changes (lot, date, place)
+            VALUES (OLD.lot, OLD.date, OLD.place);
+        END
+    """
+    )
 
-            if manually_deleted:
-                cursor.execute(
-                    "UPDATE bookings SET manually_deleted = 1 WHERE place = ? AND user = ? AND day = ?",
-                    (place, user, day),
-                )
-            else:
-                cursor.execute(
-                    "DELETE FROM bookings WHERE place = ? AND user = ? AND day = ?",
-                    (place, user, day),
-                )
 
-            cursor.execute(
-                "SELECT COUNT(*) FROM bookings WHERE place = ? AND day = ? AND is_temp = 0",
-                (place, day),
-            )
-            permanent_booking_exists = cursor.fetchone()[0] > 0
+def _pop_calendar_changes(cursor):
+    cursor.execute(
+        """
+        SELECT ch.lot, ch.date, ch.place, c.lot IS NOT NULL
+        FROM calendar_changes ch
+        LEFT JOIN calendar c
+            ON c.lot = ch.lot AND c.date = ch.date AND c.place = ch.place
+    """
+    )
+    changes = cursor.fetchall()
+    cursor.execute("DELETE FROM calendar_changes")
+    return changes
+
+
+def _reset_schedule_cache():
+    _schedule_cache["version"] += 1
+    _schedule_cache["schedules"] = {}
+    _schedule_cache["availability"] = {}
+
+
+def invalidate_schedule_cache():
+    with _schedule_lock:
+        _reset_schedule_cache()
+
+
+def _update_booking_generation(before, after, changes=()):
+    # before отличается от известного значения, если брони изменил другой
+    # процесс бота: его изменения неизвестны, поэтому кеш сбрасывается
+    # целиком. Изменения этого процесса переносятся в индексы свободных
+    # мест, а снимки расписания с именами пользователей сбрасываются.
+    with _schedule_lock:
+        if _schedule_cache["generation"] != before:
+            _reset_schedule_cache()
+        elif after != before:
+            _schedule_cache["version"] += 1
+            _schedule_cache["schedules"] = {}
+            lots = {}
+            for lot, date, place, occupied in changes:
+                lots.setdefault(lot, []).append((date, place, occupied))
+            for lot, lot_changes in lots.items():
+                availability = _schedule_cache["availability"].get(lot)
+                if availability is not None:
+                    availability.update(lot_changes)
+        _schedule_cache["generation"] = after
+
+
+def get_cached_schedule(lot, start):
+    # Расписание каждой парковки загружается отдельно и только по запросу,
+    # поэтому после изменения броней перечитываются лишь нужные парковки.
+    with _schedule_lock:
+        return _schedule_cache["version"], _schedule_cache["schedules"].get(
+            (lot, start)
+        )
 
-            if permanent_booking_exists:
-                cursor.execute(
-                    "DELETE FROM bookings WHERE place = ? AND user = ? AND day = ?",
-                    (place, user, day),
-                )
 
-            cursor.execute(
-                "DELETE FROM bookings WHERE place = ? AND day = ? AND is_temp = 1",
-                (place, day),
+def get_cached_availability(lot, places):
+    with _schedule_lock:
+        version = _schedule_cache["version"]
+        availability = _schedule_cache["availability"].get(lot)
+    if availability is not None and availability.places == tuple(places):
+        return version, availability
+    return version, None
+
+
+@write_operation
+def seed_access_tables(cursor, lots):
+    # Списки из config.py используются только для первого запуска парковки,
+    # дальше пользователи и места меняются командами администратора.
+    cursor.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM lots")
+    position = cursor.fetchone()[0]
+
+    for lot, settings in lots.items():
+        cursor.execute(
+            "INSERT OR IGNORE INTO lots (lot, title, position) VALUES (?, ?, ?)",
+            (lot, settings["title"], position),
+        )
+        position += cursor.rowcount
+
+        cursor.execute("SELECT 1 FROM access_users WHERE lot = ? LIMIT 1", (lot,))
+        if cursor.fetchone() is None:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO access_users (lot, user_id, role) VALUES (?, ?, ?)",
+                [(lot, user_id, "vip") for user_id in settings["vip_users"]]
+                + [
+                    (lot, user_id, "whitelist")
+                    for user_id in settings["whitelist_users"]
+                ],
             )
-            cursor.execute(
-                "DELETE FROM temp_bookings WHERE place = ? AND day = ?", (place, day)
+
+        cursor.execute("SELECT 1 FROM places WHERE lot = ? LIMIT 1", (lot,))
+        if cursor.fetchone() is None:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO places (lot, name, position) VALUES (?, ?, ?)",
+                [
+                    (lot, place, position)
+                    for position, place in enumerate(settings["places"])
+                ],
             )
 
-            connection.commit()
-            connection.close()
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                time.sleep(1)
-            else:
-                raise e
 
+# День недели даты в SQLite: strftime('%w') считает от воскресенья, а дни
+# в базе — от понедельника, как date.weekday().
+_WEEKDAY_SQL = "(CAST(strftime('%w', {}) AS INTEGER) + 6) % 7"
 
-def delete_booking(place: str, day: str):
-    max_attempts = 5
-    attempt = 0
 
-    while attempt < max_attempts:
-        try:
-            with sqlite3.connect("database.db") as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "DELETE FROM bookings WHERE place = ? AND day = ?", (place, day)
-                )
-                conn.commit()
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                time.sleep(1)
-                attempt += 1
-            else:
-                raise e
-    else:
-        print("Не удалось удалить бронирование после нескольких попыток.")
+def _load_calendar(cursor, lot, start, end):
+    # Календарь хранит готовую занятость мест по датам, поэтому диапазон дат
+    # читается одним отрезком первичного ключа (lot, date, place).
+    cursor.execute(
+        """
+        SELECT date, place, user, is_temp, original_user
+        FROM calendar
+        WHERE lot = ? AND date BETWEEN ? AND ?
+    """,
+        (lot, start.isoformat(), end.isoformat()),
+    )
+    return cursor.fetchall()
 
 
-def check_is_permtemp_status(place: str, user: str, day: str) -> str:
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+def load_schedule_details(lot, start, end):
+    with get_connection() as connection:
+        rows = _load_calendar(connection.cursor(), lot, start, end)
 
-    try:
-        while True:
-            try:
-                cursor.execute(
-                    """
-                    SELECT is_temp FROM bookings WHERE place = ? AND user = ? AND day = ?
-                """,
-                    (place, user, day),
-                )
+    schedule = {}
+    for date, place, user, is_temp, original_user in rows:
+        date = datetime.date.fromisoformat(date)
+        if date not in schedule:
+            schedule[date] = {}
+        schedule[date][place] = {
+            "user": user,
+            "is_temp": bool(is_temp),
+            "original_user": original_user if is_temp else None,
+        }
 
-                result = cursor.fetchone()
-                if result is not None:
-                    return "Временная" if result[0] == 1 else "Перманентная"
-                else:
-                    return "Не забронировано"
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e):
-                    time.sleep(1)
-                else:
-                    raise e
-    finally:
-        cursor.close()
-        connection.close()
+    return schedule
 
 
-def delete_temp_booking(place: str, user: str, reservation_date: str):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+def get_schedule_snapshot(lot, start):
+    version, schedule = get_cached_schedule(lot, start)
+    if schedule is not None:
+        return version, schedule
 
-    try:
-        while True:
-            try:
-                cursor.execute(
-                    """ 
-                    DELETE FROM temp_bookings 
-                    WHERE place = ? AND user = ? AND reservation_date = ?
-                """,
-                    (place, user, reservation_date),
-                )
+    schedule = load_schedule_details(lot, start, start + datetime.timedelta(days=6))
+    with _schedule_lock:
+        if _schedule_cache["version"] == version:
+            _schedule_cache["schedules"][(lot, start)] = schedule
 
-                connection.commit()
-                break
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e):
-                    time.sleep(1)
-                else:
-                    raise e
-    finally:
-        cursor.close()
-        connection.close()
+    return version, schedule
 
 
-def delete_temp_bookings_from_temp_handler(place: str, user: str, day: str):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+def get_availability(lot, places):
+    # Индекс строится одним отрезком календаря при первом запросе, дальше
+    # поток записи обновляет в нем только измененные места и даты.
+    version, availability = get_cached_availability(lot, places)
+    if availability is not None:
+        return availability
 
-    try:
-        while True:
-            try:
-                cursor.execute(
-                    """ 
-                    DELETE FROM bookings 
-                    WHERE place = ? AND user = ? AND day = ? AND is_temp = 1
-                """,
-                    (place, user, day),
-                )
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT date, place FROM calendar WHERE lot = ?", (lot,))
+        availability = Availability(places, cursor.fetchall())
+    with _schedule_lock:
+        if _schedule_cache["version"] == version:
+            _schedule_cache["availability"][lot] = availability
 
-                connection.commit()
-                break
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e):
-                    time.sleep(1)
-                else:
-                    raise e
-    finally:
-        cursor.close()
-        connection.close()
+    return availability
 
 
-def get_schedule():
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
-    cursor.execute("SELECT day, place, user FROM bookings")
-    rows = cursor.fetchall()
-    connection.close()
+def get_free_counts(lot, places, dates):
+    availability = get_availability(lot, places)
+    return [availability.free_count(date) for date in dates]
 
-    schedule = {}
-    for day, place, user in rows:
-        if day not in schedule:
-            schedule[day] = {}
-        schedule[day][place] = user
 
-    return schedule
+def pick_free_place(lot, places, date, preferred=()):
+    availability = get_availability(lot, places)
+    return availability.pick(date, availability.mask(preferred))
 
 
-def get_booked_places(place, day):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+def _find_occupant(cursor, lot, place, date):
     cursor.execute(
-        "SELECT user FROM bookings WHERE place = ? AND day = ?", (place, day)
+        "SELECT user, is_temp FROM calendar WHERE lot = ? AND date = ? AND place = ?",
+        (lot, date.isoformat(), place),
     )
     result = cursor.fetchone()
-    connection.close()
+    if result:
+        return {"user": result[0], "is_temp": bool(result[1])}
+    return None
 
-    return result[0] if result else None
+
+def get_booked_places_for_button(lot, username):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT permanent FROM booking_counts WHERE lot = ? AND user = ?",
+            (lot, username),
+        )
+        result = cursor.fetchone()
+    return result[0] if result else 0
 
 
-def get_booked_places_for_button(username):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+def _roll_calendar(cursor):
+    # Календарь покрывает CALENDAR_WEEKS недель начиная с сегодняшнего дня и
+    # еще один день, чтобы до смены дня в нем была последняя дата, которую
+    # можно выбрать в меню. Строки новых дат заполняют триггеры
+    # calendar_dates, поэтому смена дня добавляет только одну дату.
+    today = datetime.date.today()
+    cursor.execute("DELETE FROM calendar_dates WHERE date < ?", (today.isoformat(),))
+    dates = [today + datetime.timedelta(days=i) for i in range(CALENDAR_WEEKS * 7 + 1)]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO calendar_dates (date, weekday) VALUES (?, ?)",
+        [(date.isoformat(), date.weekday()) for date in dates],
+    )
+
+
+@write_operation
+def roll_calendar(cursor):
+    _roll_calendar(cursor)
+
+
+@write_operation
+def restore_bookings(cursor):
+    today = datetime.date.today().isoformat()
+
+    # Правила перманентных броней не меняются временными бронями, поэтому
+    # смена дня только сдвигает календарь и удаляет прошедшие даты одним
+    # запросом по индексу idx_occupancy_date. Перманентная бронь, которую
+    # временно заняли, снова действует со следующей недели.
     cursor.execute(
-        "SELECT COUNT(*) FROM bookings WHERE user = ? AND is_temp = 0", (username,)
+        f"""
+        SELECT COUNT(*), COUNT(p.user)
+        FROM occupancy o
+        LEFT JOIN permanent_bookings p
+            ON p.lot = o.lot
+           AND p.weekday = {_WEEKDAY_SQL.format("o.date")}
+           AND p.place = o.place
+        WHERE o.date < ?
+    """,
+        (today,),
     )
-    count = cursor.fetchone()[0]
-    connection.close()
-    return count
+    expired, restored = cursor.fetchone()
+    _roll_calendar(cursor)
+    cursor.execute("DELETE FROM occupancy WHERE date < ?", (today,))
+    # Прошедшие даты освобождают места только в прошлом, поэтому очереди на
+    # них просто удаляются.
+    cursor.execute("DELETE FROM waitlist WHERE date < ?", (today,))
+
+    released = expired - restored
+    if expired:
+        print(
+            f"Expired {expired} temporary bookings: {restored} restored, {released} released."
+        )
+    return {"restored": restored, "released": released}
 
 
-def create_temp_booking(place, user, reservation_date, restore_date, day):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+@write_operation
+def ensure_default_subscriptions(cursor, members):
+    cursor.executemany(
+        """
+        INSERT INTO subscriptions (lot, user_id, kind)
+        SELECT ?, ?, 'all'
+        WHERE NOT EXISTS (
+            SELECT 1 FROM subscriptions WHERE lot = ? AND user_id = ?
+        )
+    """,
+        [(lot, user_id, lot, user_id) for lot, user_id in members],
+    )
+
+
+def get_subscriptions(lot, user_id):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT kind, value FROM subscriptions WHERE lot = ? AND user_id = ?",
+            (lot, user_id),
+        )
+        rows = cursor.fetchall()
+        cursor.execute(
+            "SELECT mode FROM notification_settings WHERE user_id = ?", (user_id,)
+        )
+        mode = cursor.fetchone()
+
+    subscriptions = {
+        "all": False,
+        "none": False,
+        "freed": False,
+        "places": set(),
+        "days": set(),
+        "mode": mode[0] if mode else "instant",
+    }
+    for kind, value in rows:
+        if kind == "place":
+            subscriptions["places"].add(value)
+        elif kind == "day":
+            subscriptions["days"].add(int(value))
+        elif kind in ("all", "none", "freed"):
+            subscriptions[kind] = True
+
+    if not rows:
+        subscriptions["all"] = True
+
+    return subscriptions
+
+
+@write_operation
+def set_subscription_mode(cursor, lot, user_id, kind):
+    if kind not in ("all", "none"):
+        raise ValueError(f"Unknown subscription mode: {kind}")
 
     cursor.execute(
-        "SELECT user FROM bookings WHERE place = ? AND day = ? AND is_temp = ?",
-        (place, day, False),
+        "DELETE FROM subscriptions WHERE lot = ? AND user_id = ?", (lot, user_id)
+    )
+    cursor.execute(
+        "INSERT INTO subscriptions (lot, user_id, kind) VALUES (?, ?, ?)",
+        (lot, user_id, kind),
     )
-    result = cursor.fetchone()
 
-    if result:
-        original_user = result[0]
+
+@write_operation
+def toggle_subscription(cursor, lot, user_id, kind, value=""):
+    if kind not in ("place", "day", "freed"):
+        raise ValueError(f"Unknown subscription kind: {kind}")
+
+    cursor.execute(
+        "DELETE FROM subscriptions WHERE lot = ? AND user_id = ? AND kind = ? AND value = ?",
+        (lot, user_id, kind, value),
+    )
+
+    if cursor.rowcount == 0:
         cursor.execute(
-            "INSERT INTO temp_bookings (place, user, day, original_user, reservation_date, restore_date) VALUES (?, ?, ?, ?, ?, ?)",
-            (place, user, day, original_user, reservation_date, restore_date),
+            "DELETE FROM subscriptions WHERE lot = ? AND user_id = ? AND kind IN ('all', 'none')",
+            (lot, user_id),
         )
         cursor.execute(
-            "DELETE FROM bookings WHERE place = ? AND day = ? AND is_temp = ?",
-            (place, day, False),
+            "INSERT INTO subscriptions (lot, user_id, kind, value) VALUES (?, ?, ?, ?)",
+            (lot, user_id, kind, value),
         )
     else:
         cursor.execute(
-            "INSERT INTO temp_bookings (place, user, day, reservation_date, restore_date) VALUES (?, ?, ?, ?, ?)",
-            (place, user, day, reservation_date, restore_date),
+            "SELECT 1 FROM subscriptions WHERE lot = ? AND user_id = ? LIMIT 1",
+            (lot, user_id),
         )
+        if cursor.fetchone() is None:
+            cursor.execute(
+                "INSERT INTO subscriptions (lot, user_id, kind) VALUES (?, ?, 'none')",
+                (lot, user_id),
+            )
+
+
+@write_operation
+def set_notification_mode(cursor, user_id, mode):
+    if mode not in ("instant", "daily", "weekly"):
+        raise ValueError(f"Unknown notification mode: {mode}")
 
     cursor.execute(
-        "INSERT OR REPLACE INTO bookings (place, user, day, is_temp) VALUES (?, ?, ?, ?)",
-        (place, user, day, True),
+        "INSERT OR REPLACE INTO notification_settings (user_id, mode) VALUES (?, ?)",
+        (user_id, mode),
     )
 
-    connection.commit()
-    connection.close()
 
+def get_notification_recipients(lot, place, weekday, released=False):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            SELECT recipients.user_id, COALESCE(settings.mode, 'instant')
+            FROM (
+                SELECT user_id FROM subscriptions
+                WHERE lot = :lot AND kind = 'all'
+                UNION
+                SELECT user_id FROM subscriptions
+                WHERE lot = :lot AND kind = 'place' AND value = :place
+                UNION
+                SELECT user_id FROM subscriptions
+                WHERE lot = :lot AND kind = 'day' AND value = :weekday
+                UNION
+                SELECT user_id FROM subscriptions
+                WHERE lot = :lot AND kind = 'freed' AND value = '' AND :released
+            ) AS recipients
+            LEFT JOIN notification_settings AS settings
+                ON settings.user_id = recipients.user_id
+        """,
+            {
+                "lot": lot,
+                "place": place,
+                "weekday": str(weekday),
+                "released": bool(released),
+            },
+        )
+        return dict(cursor.fetchall())
 
-def restore_bookings():
-    today = datetime.date.today()
 
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+@write_operation
+def add_digest_events(cursor, user_ids, message):
+    created_at = datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+    cursor.executemany(
+        "INSERT INTO digest_events (user_id, message, created_at) VALUES (?, ?, ?)",
+        [(user_id, message, created_at) for user_id in user_ids],
+    )
+
 
+@write_operation
+def pop_digest_events(cursor, modes):
+    placeholders = ", ".join("?" for _ in modes)
     cursor.execute(
-        "SELECT place, day, original_user FROM temp_bookings WHERE restore_date < ?",
-        (today,),
+        f"""
+        SELECT events.id, events.user_id, events.message, events.created_at
+        FROM digest_events AS events
+        LEFT JOIN notification_settings AS settings
+            ON settings.user_id = events.user_id
+        WHERE COALESCE(settings.mode, 'instant') IN ({placeholders})
+        ORDER BY events.user_id, events.id
+    """,
+        tuple(modes),
     )
     rows = cursor.fetchall()
+    cursor.executemany(
+        "DELETE FROM digest_events WHERE id = ?", [(row[0],) for row in rows]
+    )
 
-    for row in rows:
-        place, day, original_user = row
-        print(f"Restoring booking for {place} on {day} by {original_user}.")
+    digests = {}
+    for _, user_id, message, created_at in rows:
+        digests.setdefault(user_id, []).append((created_at, message))
+    return digests
 
-        if original_user:
-            cursor.execute(
-                "SELECT manually_deleted FROM bookings WHERE place = ? AND day = ? AND user = ?",
-                (place, day, original_user),
-            )
-            result = cursor.fetchone()
-            if result and result[0]:
-                print(
-                    f"Permanent booking for {original_user} was manually deleted. Not restoring."
-                )
-            else:
-                cursor.execute(
-                    "INSERT OR REPLACE INTO bookings (place, user, day, is_temp) VALUES (?, ?, ?, ?)",
-                    (place, original_user, day, False),
-                )
 
-        cursor.execute(
-            "DELETE FROM bookings WHERE place = ? AND day = ? AND is_temp = 1",
-            (place, day),
-        )
+def _check_user_day(cursor, lot, username, date):
+    cursor.execute(
+        """
+        SELECT place, is_temp FROM calendar
+        WHERE lot = ? AND user = ? AND date = ?
+        ORDER BY is_temp
+        LIMIT 1
+    """,
+        (lot, username, date.isoformat()),
+    )
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    if result[1]:
+        return {"status": "has_temp", "place": result[0]}
+    return {"status": "has_permanent", "place": result[0]}
 
+
+def _check_user_weekday(cursor, lot, username, date):
+    # Правило действует на все даты дня недели, поэтому бронь пользователя
+    # проверяется на каждой из них, а не только на ближайшей дате. Правило
+    # ищется в permanent_bookings, потому что на ближайшей дате его может
+    # перекрывать временная бронь другого пользователя.
+    cursor.execute(
+        "SELECT place FROM permanent_bookings WHERE lot = ? AND user = ? AND weekday = ?",
+        (lot, username, date.weekday()),
+    )
+    result = cursor.fetchone()
+    if result:
+        return {"status": "has_permanent", "place": result[0], "date": date}
+
+    cursor.execute(
+        """
+        SELECT c.place, c.date
+        FROM calendar c
+        JOIN calendar_dates d ON d.date = c.date
+        WHERE c.lot = ? AND c.user = ? AND d.weekday = ?
+        ORDER BY c.date
+        LIMIT 1
+    """,
+        (lot, username, date.weekday()),
+    )
+    result = cursor.fetchone()
+    if result:
+        return {
+            "status": "has_temp",
+            "place": result[0],
+            "date": datetime.date.fromisoformat(result[1]),
+        }
+    return None
+
+
+@write_operation
+def book_permanent(cursor, lot, place, username, date, is_vip):
+    if not username:
+        raise ValueError("User cannot be empty.")
+
+    outcome = _check_user_weekday(cursor, lot, username, date)
+    if outcome:
+        return outcome
+
+    cursor.execute(
+        "SELECT permanent FROM booking_counts WHERE lot = ? AND user = ?",
+        (lot, username),
+    )
+    result = cursor.fetchone()
+    if result and result[0] >= MAX_PERMANENT_BOOKINGS:
+        return {"status": "limit_reached", "count": result[0]}
+
+    occupant = _find_occupant(cursor, lot, place, date)
+    booked_user = occupant["user"] if occupant else None
+
+    if booked_user and not is_vip:
+        return {"status": "taken", "booked_user": booked_user, "is_temp": False}
+
+    if occupant and occupant["is_temp"]:
         cursor.execute(
-            "DELETE FROM temp_bookings WHERE place = ? AND day = ?", (place, day)
+            "DELETE FROM occupancy WHERE lot = ? AND date = ? AND place = ?",
+            (lot, date.isoformat(), place),
         )
 
-    cursor.execute("DELETE FROM temp_bookings WHERE restore_date < ?", (today,))
+    cursor.execute(
+        """
+        INSERT INTO permanent_bookings (lot, weekday, place, user) VALUES (?, ?, ?, ?)
+        ON CONFLICT (lot, weekday, place) DO UPDATE SET user = excluded.user
+    """,
+        (lot, date.weekday(), place, username),
+    )
+
+    if booked_user:
+        return {"status": "overridden", "previous_user": booked_user}
+    return {"status": "booked"}
+
+
+@write_operation
+def book_temporary(cursor, lot, place, username, date, is_vip):
+    if not username:
+        raise ValueError("User cannot be empty.")
 
-    connection.commit()
-    connection.close()
+    outcome = _check_user_day(cursor, lot, username, date)
+    if outcome:
+        return outcome
 
+    occupant = _find_occupant(cursor, lot, place, date)
+    booked_user = occupant["user"] if occupant else None
 
-def restore_bookings_manually(place, day):
-    print(f"restore_bookings_manually called for place {place} on day {day}")
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
+    if booked_user and not is_vip:
+        return {
+            "status": "taken",
+            "booked_user": booked_user,
+            "is_temp": occupant["is_temp"],
+        }
 
     cursor.execute(
-        "SELECT original_user FROM temp_bookings WHERE place = ? AND day = ?",
-        (place, day),
+        """
+        INSERT INTO occupancy (lot, date, place, user) VALUES (?, ?, ?, ?)
+        ON CONFLICT (lot, date, place) DO UPDATE SET user = excluded.user
+    """,
+        (lot, date.isoformat(), place, username),
     )
-    result = cursor.fetchone()
 
-    if result and result[0]:
-        original_user = result[0]
+    if booked_user:
+        return {"status": "overridden", "previous_user": booked_user}
+    return {"status": "booked"}
+
+
+@write_operation
+def remove_place_booking(cursor, lot, place, username, date, is_vip):
+    occupant = _find_occupant(cursor, lot, place, date)
+    if occupant is None:
+        return {"status": "not_booked"}
 
+    booked_user = occupant["user"]
+    if not is_vip and booked_user != username:
+        return {"status": "forbidden", "booked_user": booked_user}
+
+    # Удаление временной брони снова открывает перманентную бронь этого дня
+    # недели, если она есть. Удаление перманентной брони удаляет правило и
+    # освобождает место на все даты календаря этого дня недели.
+    if occupant["is_temp"]:
         cursor.execute(
-            "SELECT manually_deleted FROM bookings WHERE place = ? AND day = ? AND user = ?",
-            (place, day, original_user),
+            "DELETE FROM occupancy WHERE lot = ? AND date = ? AND place = ?",
+            (lot, date.isoformat(), place),
         )
-        result_manual = cursor.fetchone()
+        dates = [date]
+    else:
+        cursor.execute(
+            "DELETE FROM permanent_bookings WHERE lot = ? AND weekday = ? AND place = ?",
+            (lot, date.weekday(), place),
+        )
+        cursor.execute(
+            "SELECT date FROM calendar_dates WHERE weekday = ? ORDER BY date",
+            (date.weekday(),),
+        )
+        dates = [datetime.date.fromisoformat(row[0]) for row in cursor.fetchall()]
+
+    restored = _find_occupant(cursor, lot, place, date)
+    restored_user = restored["user"] if restored else None
+    assigned, released = _assign_waiters(cursor, lot, place, dates, username)
+
+    if is_vip:
+        return {
+            "status": "removed_by_vip",
+            "booked_user": booked_user,
+            "restored_user": restored_user,
+            "assigned": assigned,
+            "released": released,
+        }
+    return {
+        "status": "removed",
+        "was_temp": occupant["is_temp"],
+        "restored_user": restored_user,
+        "assigned": assigned,
+        "released": released,
+    }
+
+
+def _assign_waiters(cursor, lot, place, dates, removed_by):
+    # Освободившееся место отдается первому по очереди пользователю, у
+    # которого нет брони на эту дату. Очереди на это место и на любое место
+    # парковки обслуживаются вместе в порядке записи. Пользователь, который
+    # удалил бронь, место обратно не получает.
+    assigned = []
+    released = False
+    for date in dates:
+        if _find_occupant(cursor, lot, place, date) is not None:
+            continue
 
-        if result_manual and result_manual[0]:
-            print(
-                f"Permanent booking for {original_user} was manually deleted. Not restoring."
+        cursor.execute(
+            """
+            SELECT w.user, w.user_id
+            FROM waitlist w
+            JOIN access_users a ON a.lot = w.lot AND a.user_id = w.user_id
+            WHERE w.lot = ? AND w.date = ? AND w.place IN (?, '') AND w.user != ?
+            ORDER BY w.id
+        """,
+            (lot, date.isoformat(), place, removed_by),
+        )
+        for user, user_id in cursor.fetchall():
+            if _check_user_day(cursor, lot, user, date) is not None:
+                continue
+            cursor.execute(
+                "INSERT INTO occupancy (lot, date, place, user) VALUES (?, ?, ?, ?)",
+                (lot, date.isoformat(), place, user),
             )
-        else:
             cursor.execute(
-                "INSERT OR REPLACE INTO bookings (place, user, day, is_temp) VALUES (?, ?, ?, ?)",
-                (place, original_user, day, False),
+                "DELETE FROM waitlist WHERE lot = ? AND date = ? AND user_id = ?",
+                (lot, date.isoformat(), user_id),
             )
-            print(
-                f"Booking for {original_user} on {place} for {day} has been restored."
+            assigned.append(
+                {"user": user, "user_id": user_id, "place": place, "date": date}
             )
+            break
+        else:
+            released = True
+
+    return assigned, released
+
+
+@write_operation
+def join_waitlist(cursor, lot, date, place, username, user_id):
+    if not username:
+        raise ValueError("User cannot be empty.")
+
+    outcome = _check_user_day(cursor, lot, username, date)
+    if outcome:
+        return outcome
 
+    # Пока место свободно, в очередь не записывают: его можно забронировать.
+    if place:
+        free = _find_occupant(cursor, lot, place, date) is None
+    else:
         cursor.execute(
-            "DELETE FROM temp_bookings WHERE place = ? AND day = ?", (place, day)
+            """
+            SELECT 1 FROM places p
+            WHERE p.lot = ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM calendar c
+                  WHERE c.lot = p.lot AND c.date = ? AND c.place = p.name
+              )
+            LIMIT 1
+        """,
+            (lot, date.isoformat()),
         )
-        print(f"Temporary booking on {place} for {day} has been removed.")
+        free = cursor.fetchone() is not None
+    if free:
+        return {"status": "free"}
 
-    connection.commit()
-    connection.close()
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO waitlist (lot, date, place, user, user_id)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        (lot, date.isoformat(), place, username, user_id),
+    )
+    status = "joined" if cursor.rowcount == 1 else "already_waiting"
 
+    # Позиция считается среди записей, которые претендуют на то же место.
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM waitlist
+        WHERE lot = :lot AND date = :date
+          AND (place IN (:place, '') OR :place = '')
+          AND id <= (
+              SELECT id FROM waitlist
+              WHERE lot = :lot AND date = :date AND place = :place
+                AND user_id = :user_id
+          )
+    """,
+        {"lot": lot, "date": date.isoformat(), "place": place, "user_id": user_id},
+    )
+    return {"status": status, "position": cursor.fetchone()[0]}
 
-def get_temp_booked_info(place, day):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
 
-    try:
+@write_operation
+def leave_waitlist(cursor, lot, date, place, user_id):
+    cursor.execute(
+        "DELETE FROM waitlist WHERE lot = ? AND date = ? AND place = ? AND user_id = ?",
+        (lot, date.isoformat(), place, user_id),
+    )
+    return cursor.rowcount > 0
+
+
+def load_pending_deletions():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT deadline, chat_id, message_id FROM pending_deletions ORDER BY deadline"
+        )
+        return cursor.fetchall()
+
+
+@write_operation
+def add_pending_deletions(cursor, entries):
+    cursor.executemany(
+        "INSERT OR REPLACE INTO pending_deletions (deadline, chat_id, message_id) VALUES (?, ?, ?)",
+        entries,
+    )
+
+
+@write_operation
+def remove_pending_deletions(cursor, keys, deadline):
+    removed = []
+    for chat_id, message_id in keys:
         cursor.execute(
-            "SELECT user, original_user FROM temp_bookings WHERE place = ? AND day = ?",
-            (place, day),
+            """
+            DELETE FROM pending_deletions
+            WHERE chat_id = ? AND message_id = ? AND deadline <= ?
+        """,
+            (chat_id, message_id, deadline),
         )
+        if cursor.rowcount:
+            removed.append((chat_id, message_id))
+    return removed
+
+
+def get_job_runs():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT name, last_run FROM job_runs")
+        return {
+            name: datetime.datetime.fromisoformat(last_run)
+            for name, last_run in cursor.fetchall()
+        }
+
+
+@write_operation
+def record_job_run(cursor, name):
+    cursor.execute(
+        "INSERT OR REPLACE INTO job_runs (name, last_run) VALUES (?, ?)",
+        (name, datetime.datetime.now().astimezone().isoformat(timespec="seconds")),
+    )
+
+
+def load_access():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT lot, title FROM lots ORDER BY position")
+        lots = cursor.fetchall()
+        cursor.execute("SELECT lot, user_id, role FROM access_users")
+        users = cursor.fetchall()
+        cursor.execute("SELECT lot, name FROM places ORDER BY lot, position")
+        rows = cursor.fetchall()
+
+    places = {}
+    for lot, name in rows:
+        places.setdefault(lot, []).append(name)
+    return lots, users, places
+
+
+def get_user_lot(user_id):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT lot FROM user_lots WHERE user_id = ?", (user_id,))
         result = cursor.fetchone()
+    return result[0] if result else None
 
-        if result:
-            user, original_user = result
-            return {"user": user, "original_user": original_user}
-        else:
-            return {}
-    finally:
-        connection.close()
 
+@write_operation
+def set_user_lot(cursor, user_id, lot):
+    cursor.execute(
+        "INSERT OR REPLACE INTO user_lots (user_id, lot) VALUES (?, ?)",
+        (user_id, lot),
+    )
 
-def get_temp_booked_places(place, day):
-    connection = sqlite3.connect("database.db")
-    cursor = connection.cursor()
 
+@write_operation
+def set_user_role(cursor, lot, user_id, role):
+    cursor.execute(
+        """
+        INSERT INTO access_users (lot, user_id, role) VALUES (?, ?, ?)
+        ON CONFLICT (lot, user_id) DO UPDATE SET role = excluded.role
+    """,
+        (lot, user_id, role),
+    )
     cursor.execute(
-        "SELECT user FROM temp_bookings WHERE place = ? AND day = ?", (place, day)
+        """
+        INSERT INTO subscriptions (lot, user_id, kind, value)
+        SELECT ?, ?, 'all', ''
+        WHERE NOT EXISTS (
+            SELECT 1 FROM subscriptions WHERE lot = ? AND user_id = ?
+        )
+    """,
+        (lot, user_id, lot, user_id),
     )
-    temp_user = cursor.fetchone()
 
-    if temp_user:
-        connection.close()
-        return temp_user[0], True
 
+@write_operation
+def remove_user(cursor, lot, user_id):
     cursor.execute(
-        "SELECT user FROM bookings WHERE place = ? AND day = ?", (place, day)
+        "DELETE FROM access_users WHERE lot = ? AND user_id = ?", (lot, user_id)
     )
-    perm_user = cursor.fetchone()
+    return cursor.rowcount > 0
 
-    connection.close()
 
-    if perm_user:
-        return perm_user[0], False
-    else:
-        return None, False
+@write_operation
+def add_place(cursor, lot, name):
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO places (lot, name, position)
+        SELECT ?, ?, COALESCE(MAX(position) + 1, 0) FROM places WHERE lot = ?
+    """,
+        (lot, name, lot),
+    )
+    return cursor.rowcount > 0
+
+
+@write_operation
+def remove_place(cursor, lot, name):
+    cursor.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM permanent_bookings WHERE lot = :lot AND place = :place)
+             + (SELECT COUNT(*) FROM occupancy WHERE lot = :lot AND place = :place)
+    """,
+        {"lot": lot, "place": name},
+    )
+    bookings = cursor.fetchone()[0]
+    if bookings:
+        return {"status": "has_bookings", "count": bookings}
+
+    cursor.execute("DELETE FROM places WHERE lot = ? AND name = ?", (lot, name))
+    if not cursor.rowcount:
+        return {"status": "not_found"}
+    return {"status": "removed"}
@@ -0,0 +1,781 @@
+import argparse
+from collections import namedtuple
+
+from config import DEFAULT_LOT, MIGRATION_BATCH_SIZE
+from database import get_connection, invalidate_schedule_cache
+
+# Миграция выполняется в три шага: schema (DDL в одной транзакции), backfills
+# (перенос данных пачками, каждая пачка в своей транзакции) и finalize
+# (завершающие изменения и новый номер схемы в одной транзакции). Все шаги
+# можно безопасно повторить, если миграция была прервана.
+Migration = namedtuple(
+    "Migration", ["version", "description", "schema", "backfills", "finalize"]
+)
+
+# Названия дней, которыми брони хранились до версии 1 схемы.
+_LEGACY_DAYS = (
+    "Понедельник",
+    "Вторник",
+    "Среда",
+    "Четверг",
+    "Пятница",
+    "Суббота",
+    "Воскресенье",
+)
+_LEGACY_DAYS_PLACEHOLDERS = ", ".join("?" for _ in _LEGACY_DAYS)
+
+
+def _has_column(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def _table_exists(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    )
+    return cursor.fetchone() is not None
+
+
+def _add_lot_column(cursor, table, create_sql=None):
+    # Данные, созданные до появления нескольких парковок, относятся к
+    # парковке по умолчанию. Таблицы, в которых парковка входит в первичный
+    # ключ, пересоздаются по новой схеме.
+    if _has_column(cursor, table, "lot"):
+        return
+
+    if create_sql is None:
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN lot TEXT NOT NULL DEFAULT '{DEFAULT_LOT}'"
+        )
+        return
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    cursor.execute(create_sql)
+    cursor.execute(f"PRAGMA table_info({table}_old)")
+    columns = ", ".join(row[1] for row in cursor.fetchall())
+    cursor.execute(
+        f"INSERT INTO {table} (lot, {columns}) SELECT ?, {columns} FROM {table}_old",
+        (DEFAULT_LOT,),
+    )
+    cursor.execute(f"DROP TABLE {table}_old")
+
+
+def _legacy_weekday(column):
+    return (
+        f"CASE {column} "
+        + " ".join(f"WHEN '{name}' THEN {i}" for i, name in enumerate(_LEGACY_DAYS))
+        + " END"
+    )
+
+
+_SUBSCRIPTIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        lot TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (lot, user_id, kind, value)
+    )
+"""
+
+_ACCESS_USERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS access_users (
+        lot TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        role TEXT NOT NULL CHECK (role IN ('vip', 'whitelist')),
+        PRIMARY KEY (lot, user_id)
+    )
+"""
+
+_PLACES_TABLE = """
+    CREATE TABLE IF NOT EXISTS places (
+        lot TEXT NOT NULL,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (lot, name)
+    )
+"""
+
+
+def _create_booking_tables(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS permanent_bookings (
+            lot TEXT NOT NULL,
+            place TEXT NOT NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            user TEXT NOT NULL,
+            PRIMARY KEY (lot, weekday, place)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS occupancy (
+            lot TEXT NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            user TEXT NOT NULL,
+            PRIMARY KEY (lot, date, place)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_permanent_bookings_lot_user ON permanent_bookings (lot, user, weekday)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_occupancy_lot_user_date ON occupancy (lot, user, date)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occupancy_date ON occupancy (date)")
+
+    # Таблицы броней до версии 1 получают парковку, чтобы их строки можно
+    # было перенести пачками.
+    for table in ("bookings", "temp_bookings"):
+        if _table_exists(cursor, table):
+            _add_lot_column(cursor, table)
+
+
+def _create_subscription_tables(cursor):
+    cursor.execute(_SUBSCRIPTIONS_TABLE)
+    _add_lot_column(cursor, "subscriptions", _SUBSCRIPTIONS_TABLE)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_lot_kind_value ON subscriptions (lot, kind, value)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS notification_settings (
+            user_id INTEGER PRIMARY KEY,
+            mode TEXT NOT NULL DEFAULT 'instant'
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS digest_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_digest_events_user ON digest_events (user_id, id)"
+    )
+
+
+def _create_job_tables(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending_deletions (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            deadline REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_pending_deletions_deadline ON pending_deletions (deadline)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS job_runs (
+            name TEXT PRIMARY KEY,
+            last_run TIMESTAMP NOT NULL
+        )
+    """
+    )
+
+
+def _create_booking_counts(cursor):
+    # Счетчики без парковки пересоздаются вместе с триггерами, таблица все
+    # равно заполняется заново в _finish_base_schema.
+    if _table_exists(cursor, "booking_counts") and not _has_column(
+        cursor, "booking_counts", "lot"
+    ):
+        cursor.execute("DROP TRIGGER IF EXISTS trg_booking_counts_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS trg_booking_counts_delete")
+        cursor.execute("DROP TRIGGER IF EXISTS trg_booking_counts_update")
+        cursor.execute("DROP TABLE booking_counts")
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS booking_counts (
+            lot TEXT NOT NULL,
+            user TEXT NOT NULL,
+            permanent INTEGER NOT NULL DEFAULT 0,
+            temp INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (lot, user)
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_counts_insert
+        AFTER INSERT ON permanent_bookings
+        BEGIN
+            INSERT INTO booking_counts (lot, user, permanent) VALUES (NEW.lot, NEW.user, 1)
+            ON CONFLICT (lot, user) DO UPDATE SET permanent = permanent + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_counts_delete
+        AFTER DELETE ON permanent_bookings
+        BEGIN
+            UPDATE booking_counts SET permanent = permanent - 1
+            WHERE lot = OLD.lot AND user = OLD.user;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_counts_update
+        AFTER UPDATE OF lot, user ON permanent_bookings
+        BEGIN
+            UPDATE booking_counts SET permanent = permanent - 1
+            WHERE lot = OLD.lot AND user = OLD.user;
+            INSERT INTO booking_counts (lot, user, permanent) VALUES (NEW.lot, NEW.user, 1)
+            ON CONFLICT (lot, user) DO UPDATE SET permanent = permanent + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_counts_insert
+        AFTER INSERT ON occupancy
+        BEGIN
+            INSERT INTO booking_counts (lot, user, temp) VALUES (NEW.lot, NEW.user, 1)
+            ON CONFLICT (lot, user) DO UPDATE SET temp = temp + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_counts_delete
+        AFTER DELETE ON occupancy
+        BEGIN
+            UPDATE booking_counts SET temp = temp - 1
+            WHERE lot = OLD.lot AND user = OLD.user;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_counts_update
+        AFTER UPDATE OF lot, user ON occupancy
+        BEGIN
+            UPDATE booking_counts SET temp = temp - 1
+            WHERE lot = OLD.lot AND user = OLD.user;
+            INSERT INTO booking_counts (lot, user, temp) VALUES (NEW.lot, NEW.user, 1)
+            ON CONFLICT (lot, user) DO UPDATE SET temp = temp + 1;
+        END
+    """
+    )
+
+
+def _create_access_tables(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lots (
+            lot TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            position INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute(_ACCESS_USERS_TABLE)
+    _add_lot_column(cursor, "access_users", _ACCESS_USERS_TABLE)
+    cursor.execute(_PLACES_TABLE)
+    _add_lot_column(cursor, "places", _PLACES_TABLE)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_lots (
+            user_id INTEGER PRIMARY KEY,
+            lot TEXT NOT NULL
+        )
+    """
+    )
+
+
+def _create_base_schema(cursor):
+    _create_booking_tables(cursor)
+    _create_subscription_tables(cursor)
+    _create_job_tables(cursor)
+    _create_booking_counts(cursor)
+    _create_access_tables(cursor)
+
+
+def _next_batch(cursor, table, after, batch_size):
+    # Граница пачки по id: следующая пачка продолжает с места, где
+    # закончилась предыдущая, без OFFSET и повторного чтения строк.
+    cursor.execute(
+        f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+        (after, batch_size),
+    )
+    return cursor.fetchone()[0]
+
+
+def _copy_legacy_bookings(cursor, after, batch_size):
+    # Перманентные брони становятся правилами (место, день недели). Пачки
+    # идут по возрастанию id, поэтому из нескольких броней одного места на
+    # один день остается последняя.
+    if not _table_exists(cursor, "bookings"):
+        return None
+    last = _next_batch(cursor, "bookings", after, batch_size)
+    if last is None:
+        return None
+
+    cursor.execute(
+        f"""
+        INSERT INTO permanent_bookings (lot, place, weekday, user)
+        SELECT lot, place, {_legacy_weekday("day")}, user
+        FROM bookings
+        WHERE id > ? AND id <= ?
+          AND is_temp = 0 AND manually_deleted = 0
+          AND day IN ({_LEGACY_DAYS_PLACEHOLDERS})
+        ORDER BY id
+        ON CONFLICT (lot, weekday, place) DO UPDATE SET user = excluded.user
+    """,
+        (after, last, *_LEGACY_DAYS),
+    )
+    return last
+
+
+def _copy_legacy_temp_bookings(cursor, after, batch_size):
+    # Временные брони становятся занятостью места на дату. Перманентная
+    # бронь, которую временно заняли, снова становится правилом, если
+    # владелец не удалял ее вручную: дата временной брони перекрывает его.
+    if not _table_exists(cursor, "temp_bookings"):
+        return None
+    last = _next_batch(cursor, "temp_bookings", after, batch_size)
+    if last is None:
+        return None
+
+    if _table_exists(cursor, "bookings"):
+        cursor.execute(
+            f"""
+            INSERT INTO permanent_bookings (lot, place, weekday, user)
+            SELECT t.lot, t.place, {_legacy_weekday("t.day")}, t.original_user
+            FROM temp_bookings t
+            WHERE t.id > ? AND t.id <= ?
+              AND COALESCE(t.original_user, '') != ''
+              AND t.day IN ({_LEGACY_DAYS_PLACEHOLDERS})
+              AND NOT EXISTS (
+                  SELECT 1 FROM bookings b
+                  WHERE b.lot = t.lot AND b.place = t.place AND b.day = t.day
+                    AND b.user = t.original_user AND b.manually_deleted = 1
+              )
+            ORDER BY t.id
+            ON CONFLICT (lot, weekday, place) DO NOTHING
+        """,
+            (after, last, *_LEGACY_DAYS),
+        )
+    cursor.execute(
+        """
+        INSERT INTO occupancy (lot, date, place, user)
+        SELECT lot, date(reservation_date), place, user
+        FROM temp_bookings
+        WHERE id > ? AND id <= ?
+        ORDER BY id
+        ON CONFLICT (lot, date, place) DO UPDATE SET user = excluded.user
+    """,
+        (after, last),
+    )
+    return last
+
+
+def _finish_base_schema(cursor):
+    cursor.execute(
+        f"""
+        UPDATE OR IGNORE subscriptions SET value = {_legacy_weekday("value")}
+        WHERE kind = 'day' AND value IN ({_LEGACY_DAYS_PLACEHOLDERS})
+    """,
+        _LEGACY_DAYS,
+    )
+    cursor.execute(
+        f"""
+        DELETE FROM subscriptions
+        WHERE kind = 'day' AND value IN ({_LEGACY_DAYS_PLACEHOLDERS})
+    """,
+        _LEGACY_DAYS,
+    )
+
+    # Индексы и триггеры старых таблиц удаляются вместе с ними.
+    cursor.execute("DROP TABLE IF EXISTS temp_bookings")
+    cursor.execute("DROP TABLE IF EXISTS bookings")
+
+    cursor.execute("DELETE FROM booking_counts")
+    cursor.execute(
+        """
+        INSERT INTO booking_counts (lot, user, permanent, temp)
+        SELECT lot, user, SUM(permanent), SUM(temp)
+        FROM (
+            SELECT lot, user, 1 AS permanent, 0 AS temp FROM permanent_bookings
+            UNION ALL
+            SELECT lot, user, 0, 1 FROM occupancy
+        )
+        GROUP BY lot, user
+    """
+    )
+
+
+def _create_calendar(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calendar_dates (
+            date TEXT PRIMARY KEY,
+            weekday INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calendar (
+            lot TEXT NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            user TEXT NOT NULL,
+            is_temp INTEGER NOT NULL,
+            original_user TEXT,
+            PRIMARY KEY (lot, date, place)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calendar_dates_weekday ON calendar_dates (weekday, date)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_calendar_lot_user_date ON calendar (lot, user, date)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_date ON calendar (date)")
+
+    # Новая дата календаря разворачивает правила ее дня недели и временные
+    # брони на эту дату всех парковок, удаленная дата удаляет свои строки.
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_calendar_dates_insert
+        AFTER INSERT ON calendar_dates
+        BEGIN
+            INSERT OR REPLACE INTO calendar (lot, date, place, user, is_temp, original_user)
+            SELECT p.lot, NEW.date, p.place, COALESCE(o.user, p.user),
+                   o.user IS NOT NULL, CASE WHEN o.user IS NOT NULL THEN p.user END
+            FROM permanent_bookings p
+            LEFT JOIN occupancy o
+                ON o.lot = p.lot AND o.date = NEW.date AND o.place = p.place
+            WHERE p.weekday = NEW.weekday
+            UNION ALL
+            SELECT o.lot, NEW.date, o.place, o.user, 1, NULL
+            FROM occupancy o
+            WHERE o.date = NEW.date
+              AND NOT EXISTS (
+                  SELECT 1 FROM permanent_bookings p
+                  WHERE p.lot = o.lot AND p.weekday = NEW.weekday AND p.place = o.place
+              );
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_calendar_dates_delete
+        AFTER DELETE ON calendar_dates
+        BEGIN
+            DELETE FROM calendar WHERE date = OLD.date;
+        END
+    """
+    )
+
+    # Временная бронь перекрывает правило только на свою дату. После ее
+    # удаления на эту дату снова действует правило.
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_calendar_insert
+        AFTER INSERT ON occupancy
+        BEGIN
+            INSERT OR REPLACE INTO calendar (lot, date, place, user, is_temp, original_user)
+            SELECT NEW.lot, d.date, NEW.place, NEW.user, 1, p.user
+            FROM calendar_dates d
+            LEFT JOIN permanent_bookings p
+                ON p.lot = NEW.lot AND p.weekday = d.weekday AND p.place = NEW.place
+            WHERE d.date = NEW.date;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_calendar_update
+        AFTER UPDATE OF user ON occupancy
+        BEGIN
+            UPDATE calendar SET user = NEW.user
+            WHERE lot = NEW.lot AND date = NEW.date AND place = NEW.place;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_occupancy_calendar_delete
+        AFTER DELETE ON occupancy
+        BEGIN
+            DELETE FROM calendar
+            WHERE lot = OLD.lot AND date = OLD.date AND place = OLD.place;
+            INSERT INTO calendar (lot, date, place, user, is_temp, original_user)
+            SELECT p.lot, d.date, p.place, p.user, 0, NULL
+            FROM calendar_dates d
+            JOIN permanent_bookings p
+                ON p.lot = OLD.lot AND p.weekday = d.weekday AND p.place = OLD.place
+            WHERE d.date = OLD.date;
+        END
+    """
+    )
+
+    # Правило меняет строки только тех дат календаря, которые приходятся на
+    # его день недели: не больше одной строки на неделю.
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_calendar_insert
+        AFTER INSERT ON permanent_bookings
+        BEGIN
+            INSERT INTO calendar (lot, date, place, user, is_temp, original_user)
+            SELECT NEW.lot, d.date, NEW.place, NEW.user, 0, NULL
+            FROM calendar_dates d
+            WHERE d.weekday = NEW.weekday
+            ON CONFLICT (lot, date, place) DO UPDATE SET original_user = excluded.user;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_calendar_update
+        AFTER UPDATE OF user ON permanent_bookings
+        BEGIN
+            UPDATE calendar
+            SET user = CASE WHEN is_temp THEN user ELSE NEW.user END,
+                original_user = CASE WHEN is_temp THEN NEW.user END
+            WHERE lot = NEW.lot
+              AND place = NEW.place
+              AND date IN (SELECT date FROM calendar_dates WHERE weekday = NEW.weekday);
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_permanent_calendar_delete
+        AFTER DELETE ON permanent_bookings
+        BEGIN
+            DELETE FROM calendar
+            WHERE lot = OLD.lot
+              AND place = OLD.place
+              AND is_temp = 0
+              AND date IN (SELECT date FROM calendar_dates WHERE weekday = OLD.weekday);
+            UPDATE calendar SET original_user = NULL
+            WHERE lot = OLD.lot
+              AND place = OLD.place
+              AND date IN (SELECT date FROM calendar_dates WHERE weekday = OLD.weekday);
+        END
+    """
+    )
+
+
+def _create_waitlist(cursor):
+    # Место '' означает очередь на любое место парковки на эту дату.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY,
+            lot TEXT NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL DEFAULT '',
+            user TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (lot, date, place, user_id)
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_waitlist_lot_date ON waitlist (lot, date, id)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_date ON waitlist (date)")
+
+
+def _create_booking_generation(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS booking_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        "INSERT OR IGNORE INTO booking_generation (id, generation) VALUES (1, 0)"
+    )
+
+    # Любое изменение брони меняет строки календаря, поэтому счетчик
+    # увеличивается только при записи броней и не зависит от остальных таблиц.
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_calendar_generation_insert
+        AFTER INSERT ON calendar
+        BEGIN
+            UPDATE booking_generation SET generation = generation + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_calendar_generation_delete
+        AFTER DELETE ON calendar
+        BEGIN
+            UPDATE booking_generation SET generation = generation + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_calendar_generation_update
+        AFTER UPDATE ON calendar
+        BEGIN
+            UPDATE booking_generation SET generation = generation + 1;
+        END
+    """
+    )
+
+
+MIGRATIONS = (
+    Migration(
+        1,
+        "Парковки, правила перманентных броней и занятость мест по датам",
+        _create_base_schema,
+        (_copy_legacy_bookings, _copy_legacy_temp_bookings),
+        _finish_base_schema,
+    ),
+    Migration(
+        2,
+        "Календарь занятости мест на несколько недель вперед",
+        _create_calendar,
+        (),
+        None,
+    ),
+    Migration(
+        3,
+        "Очереди ожидания мест по датам",
+        _create_waitlist,
+        (),
+        None,
+    ),
+    Migration(
+        4,
+        "Счетчик изменений броней для кеша расписания",
+        _create_booking_generation,
+        (),
+        None,
+    ),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+def _run_backfill(connection, backfill, batch_size):
+    cursor = connection.cursor()
+    after, batches = 0, 0
+    while True:
+        # Каждая пачка фиксируется отдельно, поэтому бот в другом процессе
+        # не ждет блокировку записи дольше одной пачки.
+        cursor.execute("BEGIN IMMEDIATE")
+        after = backfill(cursor, after, batch_size)
+        connection.commit()
+        if after is None:
+            return batches
+        batches += 1
+
+
+def _apply_migration(connection, migration, batch_size):
+    cursor = connection.cursor()
+
+    cursor.execute("BEGIN IMMEDIATE")
+    migration.schema(cursor)
+    connection.commit()
+
+    for backfill in migration.backfills:
+        batches = _run_backfill(connection, backfill, batch_size)
+        if batches:
+            print(
+                f"Migration {migration.version}: {backfill.__name__}, {batches} batches."
+            )
+
+    cursor.execute("BEGIN IMMEDIATE")
+    if migration.finalize is not None:
+        migration.finalize(cursor)
+    cursor.execute(f"PRAGMA user_version = {migration.version}")
+    connection.commit()
+    print(f"Migration {migration.version} applied: {migration.description}")
+
+
+def migrate(target=None, batch_size=MIGRATION_BATCH_SIZE):
+    target = LATEST_VERSION if target is None else target
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        version = get_version(cursor)
+        if version > LATEST_VERSION:
+            raise RuntimeError(
+                f"Database schema version {version} is newer than {LATEST_VERSION}."
+            )
+
+        # Если схема уже актуальна, запуск бота не выполняет ни одного DDL.
+        pending = [m for m in MIGRATIONS if version < m.version <= target]
+        if not pending:
+            return version
+
+        for migration in pending:
+            _apply_migration(connection, migration, batch_size)
+        cursor.execute("PRAGMA optimize")
+
+    invalidate_schedule_cache()
+    return pending[-1].version
+
+
+def status():
+    with get_connection() as connection:
+        version = get_version(connection.cursor())
+    return version, [(m, m.version <= version) for m in MIGRATIONS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Миграции базы данных бота.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="показать версию схемы и миграции")
+    apply_parser = commands.add_parser("apply", help="применить миграции")
+    apply_parser.add_argument(
+        "--target", type=int, help="версия, до которой применить миграции"
+    )
+    apply_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=MIGRATION_BATCH_SIZE,
+        help="количество строк в одной пачке переноса данных",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "apply":
+        version = migrate(args.target, args.batch_size)
+        print(f"Schema version: {version}")
+        return
+
+    version, migrations = status()
+    print(f"Schema version: {version} (latest {LATEST_VERSION})")
+    for migration, applied in migrations:
+        mark = "applied" if applied else "pending"
+        print(f"  {migration.version}: {migration.description} [{mark}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +0,0 @@
-PLACES = ["13", "303", "304"]
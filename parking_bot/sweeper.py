@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+import time
+
+from telegram.constants import BulkRequestLimit
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import database
+
+
+class MessageSweeper:
+    def __init__(self, bot, retry_delay=5):
+        self.bot = bot
+        self.retry_delay = retry_delay
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def load(self, entries):
+        self._heap = [tuple(entry) for entry in entries]
+        heapq.heapify(self._heap)
+
+    def schedule(self, chat_id, message_id, delay):
+        deadline = time.time() + delay
+        heapq.heappush(self._heap, (deadline, chat_id, message_id))
+        # Запись в базу выполняет поток DatabaseWriter, обработчик ее не ждет.
+        database.add_pending_deletions.submit([(deadline, chat_id, message_id)])
+
+    def pop_due(self, now=None):
+        if now is None:
+            now = time.time()
+
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            due.append((chat_id, message_id))
+        return due, now
+
+    async def sweep(self):
+        due, now = self.pop_due()
+        if not due:
+            return
+
+        # Каждый процесс бота загружает все записи при запуске, поэтому
+        # сообщение удаляет только тот процесс, который удалил его запись.
+        claimed = await asyncio.wrap_future(
+            database.remove_pending_deletions.submit(due, now)
+        )
+
+        chats = {}
+        for chat_id, message_id in claimed:
+            chats.setdefault(chat_id, []).append(message_id)
+
+        for chat_id, message_ids in chats.items():
+            for start in range(0, len(message_ids), BulkRequestLimit.MAX_LIMIT):
+                await self._delete(
+                    chat_id, message_ids[start : start + BulkRequestLimit.MAX_LIMIT]
+                )
+
+    async def _delete(self, chat_id, message_ids):
+        try:
+            await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+        except (BadRequest, Forbidden):
+            # Сообщения уже удалены, слишком старые или чат недоступен.
+            pass
+        except (RetryAfter, NetworkError):
+            for message_id in message_ids:
+                self.schedule(chat_id, message_id, self.retry_delay)
@@ -0,0 +1,308 @@
+import functools
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks
+from config import CALENDAR_WEEKS, MAX_PERMANENT_BOOKINGS
+
+RUSSIAN_DAYS = [
+    "Понедельник",
+    "Вторник",
+    "Среда",
+    "Четверг",
+    "Пятница",
+    "Суббота",
+    "Воскресенье",
+]
+SHORT_DAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+NOTIFICATION_MODES = ["instant", "daily", "weekly"]
+
+# Меню, из которых выбирается день, и действия, которые открывают их на
+# другой неделе. Перманентная бронь относится к дню недели, поэтому ее меню
+# не листается.
+_WEEK_ACTIONS = {
+    callbacks.CHOOSE_TEMP_DAY: callbacks.TEMP_BOOK,
+    callbacks.CHOOSE_REMOVE_DAY: callbacks.REMOVE,
+}
+_WEEK_PLACE_ACTIONS = (callbacks.TEMP_BOOK_PLACE, callbacks.REMOVE_PLACE)
+# Действия "любое свободное место" рядом с днями в меню бронирования.
+_ANY_PLACE_ACTIONS = {
+    callbacks.CHOOSE_DAY: callbacks.BOOK_ANY,
+    callbacks.CHOOSE_TEMP_DAY: callbacks.TEMP_BOOK_ANY,
+}
+
+
+def _mark(selected, text):
+    return f"✅ {text}" if selected else text
+
+
+class Views:
+    def __init__(self, router, lots, titles):
+        self.router = router
+        self.version = 0
+        self.set_lots(lots, titles)
+
+    def set_lots(self, lots, titles):
+        # Все клавиатуры зависят от списков парковок и мест, поэтому при их
+        # изменении они собираются заново, а кэш динамических клавиатур
+        # сбрасывается.
+        self.places = {lot: list(places) for lot, places in lots.items()}
+        self.titles = dict(titles)
+        self.router.set_lots(self.places)
+        self.version += 1
+
+        self._menus = {
+            (lot, can_book, can_switch): self._build_main_menu(
+                lot, can_book, can_switch
+            )
+            for lot in self.places
+            for can_book in (True, False)
+            for can_switch in (True, False)
+        }
+        self._day_keyboards = {
+            (lot, callbacks.CHOOSE_DAY, None): self._build_day_keyboard(
+                lot, callbacks.CHOOSE_DAY, None
+            )
+            for lot in self.places
+        }
+        self._day_keyboards.update(
+            {
+                (lot, action, week): self._build_day_keyboard(lot, action, week)
+                for lot in self.places
+                for action in _WEEK_ACTIONS
+                for week in range(CALENDAR_WEEKS)
+            }
+        )
+        self._place_keyboards = {
+            (lot, callbacks.BOOK_PLACE, day, None): self._build_place_keyboard(
+                lot, callbacks.BOOK_PLACE, day, None
+            )
+            for lot in self.places
+            for day in range(7)
+        }
+        self._place_keyboards.update(
+            {
+                (lot, action, day, week): self._build_place_keyboard(
+                    lot, action, day, week
+                )
+                for lot in self.places
+                for action in _WEEK_PLACE_ACTIONS
+                for day in range(7)
+                for week in range(CALENDAR_WEEKS)
+            }
+        )
+        self._schedule_keyboards = {
+            (lot, week): self._build_week_navigation(lot, callbacks.SCHEDULE, week)
+            for lot in self.places
+            for week in range(CALENDAR_WEEKS)
+        }
+        self._subscriptions_keyboard = functools.lru_cache(maxsize=256)(
+            self._build_subscriptions_keyboard
+        )
+        self._lot_keyboard = functools.lru_cache(maxsize=256)(self._build_lot_keyboard)
+        self._counted_day_keyboard = functools.lru_cache(maxsize=256)(
+            self._build_day_keyboard
+        )
+        self._waitlist_keyboard = functools.lru_cache(maxsize=256)(
+            self._build_waitlist_keyboard
+        )
+
+    def main_menu(self, lot, permanent_bookings_count, can_switch=False):
+        return self._menus[
+            (lot, permanent_bookings_count < MAX_PERMANENT_BOOKINGS, can_switch)
+        ]
+
+    def day_keyboard(self, lot, action, week=None, free_counts=None):
+        if free_counts is None:
+            return self._day_keyboards[(lot, action, week)]
+        return self._counted_day_keyboard(lot, action, week, tuple(free_counts))
+
+    def place_keyboard(self, lot, action, day, week=None):
+        return self._place_keyboards[(lot, action, day, week)]
+
+    def schedule_keyboard(self, lot, week):
+        return self._schedule_keyboards[(lot, week)]
+
+    def waitlist_keyboard(self, lot, action, day, week, place=None):
+        return self._waitlist_keyboard(lot, action, day, week, place)
+
+    def lot_keyboard(self, lots):
+        return self._lot_keyboard(tuple(lots))
+
+    def subscriptions_keyboard(self, lot, current):
+        return self._subscriptions_keyboard(
+            lot,
+            current["all"],
+            current["none"],
+            current["freed"],
+            frozenset(current["places"]),
+            frozenset(current["days"]),
+            current["mode"],
+        )
+
+    def _button(self, text, action, **kwargs):
+        return InlineKeyboardButton(
+            text, callback_data=self.router.encode(action, **kwargs)
+        )
+
+    def _build_main_menu(self, lot, can_book_permanent, can_switch):
+        keyboard = [[self._button("Расписание", callbacks.SCHEDULE, lot=lot)]]
+        if can_book_permanent:
+            keyboard.append(
+                [self._button("Забронировать перманентно", callbacks.BOOK, lot=lot)]
+            )
+        keyboard.append(
+            [self._button("Забронировать временно", callbacks.TEMP_BOOK, lot=lot)]
+        )
+        keyboard.append([self._button("Удалить бронь", callbacks.REMOVE, lot=lot)])
+        keyboard.append([self._button("Уведомления", callbacks.SUBSCRIPTIONS, lot=lot)])
+        if can_switch:
+            keyboard.append([self._button("Сменить парковку", callbacks.CHOOSE_LOT)])
+        return InlineKeyboardMarkup(keyboard)
+
+    def _week_buttons(self, lot, action, week):
+        buttons = []
+        if week > 0:
+            buttons.append(
+                self._button("◀ Пред. неделя", action, lot=lot, week=week - 1)
+            )
+        if week < CALENDAR_WEEKS - 1:
+            buttons.append(
+                self._button("След. неделя ▶", action, lot=lot, week=week + 1)
+            )
+        return buttons
+
+    def _build_week_navigation(self, lot, action, week):
+        buttons = self._week_buttons(lot, action, week)
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+
+    def _build_day_keyboard(self, lot, action, week, free_counts=None):
+        if free_counts is None:
+            keyboard = [
+                [self._button(RUSSIAN_DAYS[i], action, lot=lot, day=i, week=week)]
+                for i in range(7)
+            ]
+        else:
+            keyboard = [
+                self._counted_day_row(lot, action, week, i, free)
+                for i, free in enumerate(free_counts)
+            ]
+        if week is not None:
+            buttons = self._week_buttons(lot, _WEEK_ACTIONS[action], week)
+            if buttons:
+                keyboard.append(buttons)
+        return InlineKeyboardMarkup(keyboard)
+
+    def _counted_day_row(self, lot, action, week, day, free):
+        row = [
+            self._button(
+                f"{RUSSIAN_DAYS[day]} (своб. {free})",
+                action,
+                lot=lot,
+                day=day,
+                week=week,
+            )
+        ]
+        if free:
+            row.append(
+                self._button(
+                    "🎲 Любое свободное",
+                    _ANY_PLACE_ACTIONS[action],
+                    lot=lot,
+                    day=day,
+                    week=week,
+                )
+            )
+        return row
+
+    def _build_place_keyboard(self, lot, action, day, week):
+        return InlineKeyboardMarkup(
+            [
+                [
+                    self._button(
+                        f"Место {place}",
+                        action,
+                        lot=lot,
+                        day=day,
+                        place=place,
+                        week=week,
+                    )
+                ]
+                for place in self.places[lot]
+            ]
+        )
+
+    def _build_waitlist_keyboard(self, lot, action, day, week, place):
+        text = (
+            "🕒 Встать в очередь"
+            if action == callbacks.JOIN_WAITLIST
+            else "Выйти из очереди"
+        )
+        return InlineKeyboardMarkup(
+            [[self._button(text, action, lot=lot, day=day, week=week, place=place)]]
+        )
+
+    def _build_lot_keyboard(self, lots):
+        return InlineKeyboardMarkup(
+            [
+                [self._button(self.titles.get(lot, lot), callbacks.SELECT_LOT, lot=lot)]
+                for lot in lots
+                if lot in self.places
+            ]
+        )
+
+    def _build_subscriptions_keyboard(self, lot, all, none, freed, places, days, mode):
+        keyboard = [
+            [self._button(_mark(all, "Все изменения"), callbacks.SUBS_ALL, lot=lot)],
+            [
+                self._button(
+                    _mark(freed, "Освободившиеся места"), callbacks.SUBS_FREED, lot=lot
+                )
+            ],
+        ]
+        lot_places = self.places[lot]
+        keyboard += [
+            [
+                self._button(
+                    _mark(place in places, f"Место {place}"),
+                    callbacks.SUBS_PLACE,
+                    lot=lot,
+                    place=place,
+                )
+                for place in lot_places[i : i + 3]
+            ]
+            for i in range(0, len(lot_places), 3)
+        ]
+        keyboard.append(
+            [
+                self._button(
+                    _mark(i in days, short_day),
+                    callbacks.SUBS_DAY,
+                    lot=lot,
+                    day=i,
+                )
+                for i, short_day in enumerate(SHORT_DAYS)
+            ]
+        )
+        keyboard.append(
+            [
+                self._button(
+                    _mark(none, "Не присылать уведомления"),
+                    callbacks.SUBS_NONE,
+                    lot=lot,
+                )
+            ]
+        )
+        keyboard.append(
+            [
+                self._button(
+                    _mark(mode == NOTIFICATION_MODES[i], text),
+                    callbacks.SUBS_MODE,
+                    lot=lot,
+                    value=i,
+                )
+                for i, text in enumerate(("Сразу", "Раз в день", "Раз в неделю"))
+            ]
+        )
+        keyboard.append([self._button("Назад", callbacks.BACK, lot=lot)])
+        return InlineKeyboardMarkup(keyboard)